@@ -0,0 +1,37 @@
+"""
+Recorded eBay item pages used by the benchmarks and the parser parity check.
+
+Only one real page is checked in (pages/item_in_stock.html, "More than 10 available").
+The other cases are derived from it by rewriting the buy box, so every variant keeps
+the full weight of a real page.
+"""
+import os
+import re
+from typing import Dict
+
+PAGES_DIR = os.path.join(os.path.dirname(__file__), "pages")
+BASE_PAGE = "item_in_stock.html"
+
+AVAILABILITY_SPAN = re.compile(r'(<span class="ux-textspans ux-textspans--SECONDARY">)\s*More than 10 available\s*(</span>)')
+PRICE_TEXT = "US $249.99/ea"
+
+CAPTCHA_PAGE = """<!DOCTYPE html>
+<html><head><title>Pardon Our Interruption...</title></head>
+<body><h1>Pardon Our Interruption...</h1><p>As you were browsing something about your browser made us think you were a bot.</p></body></html>
+"""
+
+
+def load_base_page() -> str:
+    with open(os.path.join(PAGES_DIR, BASE_PAGE), encoding="utf-8") as file:
+        return file.read()
+
+
+def load_corpus() -> Dict[str, str]:
+    base = load_base_page()
+    return {
+        "more_than_n": base,
+        "in_stock": AVAILABILITY_SPAN.sub(r"\g<1>3 available\g<2>", base),
+        "out_of_stock": AVAILABILITY_SPAN.sub(r"\g<1>Out of Stock\g<2>", base),
+        "multi_currency": base.replace(PRICE_TEXT, "EUR 249,99"),
+        "captcha": CAPTCHA_PAGE,
+    }
@@ -0,0 +1,120 @@
+"""
+API latency while a burst of logins runs.
+
+    python benchmarks/login_load.py
+    PASSWORD_WORKERS=0 python benchmarks/login_load.py   # bcrypt on the event loop, as before
+
+Drives the FastAPI app in process over httpx's ASGI transport against a scratch database.
+--clients login loops, each from its own address, spread over --users accounts, run for
+--seconds while one poller calls GET /api/reminders every --poll-ms. Prints latency
+percentiles of the poller and of the logins, plus how many logins were turned away with 429.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import bcrypt
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+os.environ.setdefault("WS_SECRET_KEY", "benchmark")
+os.environ.setdefault("WS_ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+os.environ.setdefault("RUN_TG", "FALSE")
+
+import data
+from migrations import run_migrations
+from password_hasher import PASSWORD_WORKERS, password_hasher
+from server import app
+from services.auth_service import AuthService
+
+PASSWORD = "benchmark-password"
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def describe(name: str, seconds: list) -> str:
+    milliseconds = [x * 1000 for x in seconds]
+    if not milliseconds:
+        return f"{name:<8} no requests"
+    return (f"{name:<8} n={len(milliseconds):<5} p50={percentile(milliseconds, 0.5):7.1f}ms "
+            f"p99={percentile(milliseconds, 0.99):7.1f}ms max={max(milliseconds):7.1f}ms mean={statistics.mean(milliseconds):7.1f}ms")
+
+
+def client_for(ip: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(ip, 40000)), base_url="http://benchmark")
+
+
+async def login_loop(ip: str, email: str, deadline: float, timings: list, rejected: list):
+    async with client_for(ip) as client:
+        while time.time() < deadline:
+            start = time.perf_counter()
+            response = await client.post("/api/login", json={"email": email, "password": PASSWORD})
+            if response.status_code == 429:
+                rejected.append(1)
+                await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+            else:
+                timings.append(time.perf_counter() - start)
+
+
+async def poll_loop(token: str, deadline: float, interval: float, timings: list):
+    async with client_for("10.1.0.1") as client:
+        client.cookies.set("session_token", token)
+        while time.time() < deadline:
+            start = time.perf_counter()
+            response = await client.get("/api/reminders")
+            response.raise_for_status()
+            timings.append(time.perf_counter() - start)
+            await asyncio.sleep(interval)
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        data.pool = data.ConnectionPool(os.path.join(directory, "login.db"), data.DB_READERS)
+        await data.open_pool()
+        await data.init_db()
+        await run_migrations()
+        hashed = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+        emails = [f"user{i}@example.com" for i in range(args.users)]
+        await data.execute_query_many("INSERT INTO users (id, email, password, created_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+                                      [(f"user-{i}", email, hashed) for i, email in enumerate(emails)])
+        token = AuthService().generate_session_token(emails[0], "user-0")
+
+        # Baseline without logins, then the same poller with the burst running
+        idle = []
+        await poll_loop(token, time.time() + 1, args.poll_ms / 1000, idle)
+        polls, logins, rejected = [], [], []
+        deadline = time.time() + args.seconds
+        await asyncio.gather(
+            poll_loop(token, deadline, args.poll_ms / 1000, polls),
+            *[login_loop(f"10.0.{i // 250}.{i % 250 + 1}", emails[i % len(emails)], deadline, logins, rejected) for i in range(args.clients)]
+        )
+        password_hasher.close()
+        await data.close_pool()
+
+    print(f"workers={PASSWORD_WORKERS} clients={args.clients} users={args.users} seconds={args.seconds}")
+    print(describe("idle", idle))
+    print(describe("api", polls))
+    print(describe("login", logins))
+    print(f"logins/s={len(logins) / args.seconds:.1f} rejected={len(rejected)}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--clients", type=int, default=40)
+    arg_parser.add_argument("--users", type=int, default=10)
+    arg_parser.add_argument("--seconds", type=float, default=5)
+    arg_parser.add_argument("--poll-ms", type=int, default=20)
+    asyncio.run(main(arg_parser.parse_args()))
@@ -0,0 +1,179 @@
+"""
+Notification outbox delivery against local fakes of the Telegram Bot API and an SMTP server.
+
+    python benchmarks/notification_delivery.py
+
+Checks single delivery, digest coalescing, retry after channel errors, idempotent
+enqueueing and per-chat pacing, printing one line per scenario.
+"""
+import asyncio
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("WS_SECRET_KEY", "benchmark")
+os.environ.setdefault("WS_ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+os.environ.setdefault("RUN_TG", "FALSE")
+os.environ.setdefault("OUTBOX_RETRY_BASE_SECONDS", "0.2")
+os.environ.setdefault("TELEGRAM_MESSAGES_PER_SECOND", "5")
+
+import data
+from classes import InsertNotification
+from migrations import run_migrations
+from notification_channels import EmailChannel, TelegramChannel
+from notification_worker import OUTBOX_DIGEST_THRESHOLD, NotificationWorker
+from repository.outbox_repository import OutboxRepository
+
+
+class FakeTelegram:
+    """Records sendMessage calls, failing the next fail_next of them with fail_status"""
+    def __init__(self):
+        self.messages = []
+        self.fail_next = 0
+        self.fail_status = 500
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if fake.fail_next > 0:
+                    fake.fail_next -= 1
+                    status = fake.fail_status
+                else:
+                    fake.messages.append(body)
+                    status = 200
+                payload = json.dumps({"ok": status == 200}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+
+class FakeSmtp:
+    """Just enough SMTP to accept messages from smtplib"""
+    def __init__(self):
+        self.messages = []
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line: str):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                self.reply("220 localhost fake smtp")
+                while True:
+                    line = self.rfile.readline().decode().strip()
+                    command = line[:4].upper()
+                    if not line or command == "QUIT":
+                        self.reply("221 bye")
+                        return
+                    if command == "EHLO":
+                        self.reply("250 localhost")
+                    elif command == "DATA":
+                        self.reply("354 go ahead")
+                        lines = []
+                        while (data_line := self.rfile.readline().decode()) not in (".\r\n", ""):
+                            lines.append(data_line)
+                        fake.messages.append("".join(lines))
+                        self.reply("250 queued")
+                    else:
+                        self.reply("250 ok")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_address[1]
+
+
+def notifications(prefix: str, count: int, channel: str = "telegram", recipient: str = "42"):
+    return [InsertNotification(idempotency_key=f"{prefix}-{i}", channel=channel, recipient=recipient, message=f"{prefix} update {i}") for i in range(count)]
+
+
+async def drain(worker: NotificationWorker, timeout: float = 10):
+    """Deliver until nothing is pending"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        await worker.deliver_due()
+        pending = await data.select_one("SELECT COUNT(*) FROM notification_outbox WHERE status = 'pending'")
+        if pending[0] == 0:
+            return
+        await asyncio.sleep(0.05)
+    raise TimeoutError("outbox not drained")
+
+
+def check(name: str, ok: bool, detail: str = ""):
+    print(f"{'ok  ' if ok else 'FAIL'} {name} {detail}".rstrip())
+
+
+async def main():
+    telegram = FakeTelegram()
+    smtp = FakeSmtp()
+    with tempfile.TemporaryDirectory() as directory:
+        data.pool = data.ConnectionPool(os.path.join(directory, "outbox.db"), 2)
+        await data.init_db()
+        await run_migrations()
+        telegram_channel = TelegramChannel(token="test", api_url=telegram.url, default_chat_id="42")
+        worker = NotificationWorker({"telegram": telegram_channel, "email": EmailChannel(host="127.0.0.1", port=smtp.port, default_recipient="user@example.com")})
+        outbox = OutboxRepository()
+
+        await outbox.enqueue(notifications("single", 2) + notifications("mail", 1, "email", None))
+        await drain(worker)
+        check("single delivery", len(telegram.messages) == 2 and len(smtp.messages) == 1, f"telegram={len(telegram.messages)} email={len(smtp.messages)}")
+
+        telegram.messages.clear()
+        await outbox.enqueue(notifications("bulk", 50))
+        await drain(worker)
+        check("digest", len(telegram.messages) == 1 and "50 listing updates" in telegram.messages[0]["text"], f"messages={len(telegram.messages)} threshold={OUTBOX_DIGEST_THRESHOLD}")
+
+        telegram.messages.clear()
+        telegram.fail_next = 2
+        await outbox.enqueue(notifications("retry", 1))
+        await drain(worker)
+        row = await data.select_one("SELECT status, attempts FROM notification_outbox WHERE idempotency_key = 'retry-0'")
+        check("retry", len(telegram.messages) == 1 and row == ("sent", 3), f"status={row[0]} attempts={row[1]}")
+
+        telegram.messages.clear()
+        telegram.fail_next, telegram.fail_status = 1, 403
+        await outbox.enqueue(notifications("rejected", 1))
+        await drain(worker)
+        row = await data.select_one("SELECT status FROM notification_outbox WHERE idempotency_key = 'rejected-0'")
+        check("permanent failure", row[0] == "failed" and not telegram.messages, f"status={row[0]}")
+
+        await outbox.enqueue(notifications("single", 2))
+        count = await data.select_one("SELECT COUNT(*) FROM notification_outbox WHERE idempotency_key LIKE 'single-%'")
+        await drain(worker)
+        check("idempotency", count[0] == 2 and not telegram.messages, f"rows={count[0]}")
+
+        await outbox.enqueue(notifications("rate", OUTBOX_DIGEST_THRESHOLD - 1, recipient="7") + notifications("rate-b", OUTBOX_DIGEST_THRESHOLD - 1, recipient="8"))
+        start = time.perf_counter()
+        await drain(worker)
+        elapsed = time.perf_counter() - start
+        # Each chat is paced on its own, the two chats go out side by side rather than one after the other
+        per_chat = (OUTBOX_DIGEST_THRESHOLD - 2) / float(os.environ["TELEGRAM_MESSAGES_PER_SECOND"])
+        serial = (2 * (OUTBOX_DIGEST_THRESHOLD - 1) - 1) / float(os.environ["TELEGRAM_MESSAGES_PER_SECOND"])
+        check("rate limit", per_chat * 0.9 <= elapsed < serial * 0.9, f"{2 * (OUTBOX_DIGEST_THRESHOLD - 1)} messages to 2 chats in {elapsed:.2f}s")
+
+        await worker.close()
+        await data.close_pool()
+    telegram.server.shutdown()
+    smtp.server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
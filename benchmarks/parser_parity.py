@@ -0,0 +1,64 @@
+"""
+Parser engine parity check over the page corpus.
+
+Parses every page with each available engine, with and without the fast refresh
+fragment path, and fails if any of them returns a different SelectListing or
+ScrapedListing than the full-page BeautifulSoup reference.
+
+Usage: python benchmarks/parser_parity.py
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from corpus import load_corpus
+from parser import ListingParser
+from parser_engines import BeautifulSoupEngine, get_engine
+
+ITEM_URL = "https://www.ebay.com/itm/404300336661"
+VOLATILE_FIELDS = {"date", "scraped_at", "last_seen"}
+
+
+def normalize(value):
+    """Drop the timestamps taken at parse time so results can be compared"""
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items() if k not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [normalize(v) for v in value]
+    return value
+
+
+def run(parser: ListingParser, html: str):
+    response = SimpleNamespace(text=html, url=ITEM_URL)
+    results = {}
+    for name, parse in (("listing", lambda: parser.parse_listing(response)),
+                        ("details", lambda: parser.parse_listing_details(response, True))):
+        try:
+            results[name] = normalize(parse().model_dump())
+        except Exception as e:
+            results[name] = f"{type(e).__name__}: {e}"
+    return results
+
+
+def main():
+    reference = ListingParser(BeautifulSoupEngine(), fast_refresh=False)
+    engines = [BeautifulSoupEngine()] + [engine for engine in (get_engine("lxml"),) if engine.name != "bs4"]
+    candidates = [ListingParser(engine, fast_refresh=fast) for engine in engines for fast in (False, True)]
+    failures = 0
+    for page_name, html in load_corpus().items():
+        expected = run(reference, html)
+        for parser in candidates:
+            actual = run(parser, html)
+            status = "ok" if actual == expected else "MISMATCH"
+            if actual != expected:
+                failures += 1
+                print(f"  expected: {expected}\n  actual:   {actual}")
+            mode = "fast" if parser.fast_refresh else "full"
+            print(f"{page_name:<16} {parser.engine.name:<6} {mode:<5} {status}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Refresh cycle benchmark against a local stub HTTP server.
+
+Serves the recorded item page with an artificial delay and fetches it for N
+listings through the shared Ebay client, once per concurrency limit.
+A concurrent cycle should take roughly (listings / concurrency) * delay.
+
+Usage: python benchmarks/refresh_cycle_benchmark.py [listings] [delay_ms]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Single stub host, lift the per-host rate limit so only concurrency is measured
+os.environ.setdefault("EBAY_REQUESTS_PER_SECOND", "100000")
+os.environ.setdefault("EBAY_BURST", "100000")
+
+from ebay import Ebay
+from stub_server import base_url as server_base_url, start_stub_server
+
+PAGE_PATH = os.path.join(os.path.dirname(__file__), "pages", "item_in_stock.html")
+
+
+async def run_cycle(base_url: str, listings: int, concurrency: int) -> float:
+    ebay = Ebay(max_concurrency=concurrency)
+    urls = [f"{base_url}/itm/{100000000000 + i}" for i in range(listings)]
+    start = time.perf_counter()
+    await asyncio.gather(*[ebay.get_response(url) for url in urls])
+    elapsed = time.perf_counter() - start
+    await ebay.close()
+    return elapsed
+
+
+def main():
+    listings = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    delay = (int(sys.argv[2]) if len(sys.argv) > 2 else 200) / 1000
+    with open(PAGE_PATH, "rb") as file:
+        body = file.read()
+    server = start_stub_server(lambda path: body, delay)
+    base_url = server_base_url(server)
+    print(f"{listings} listings, {delay * 1000:.0f} ms per response")
+    try:
+        for concurrency in (1, 10, 50):
+            elapsed = asyncio.run(run_cycle(base_url, listings, concurrency))
+            print(f"concurrency={concurrency:<3} cycle={elapsed:.2f}s")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
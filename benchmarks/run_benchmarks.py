@@ -0,0 +1,292 @@
+"""
+Benchmark suite: parsing, a full refresh cycle, the DB-heavy repository queries and session validation.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --only parse --compare results.json
+
+Parsing runs over the recorded page corpus (see corpus.py) for every engine, with
+and without the fast refresh path. The refresh cycle runs Checker.update_listings
+against a local stub server. Repository queries run against scratch databases
+seeded with the requested listing counts, plus the per-user listing query at
+--user-sizes listings per user. Session validation runs AuthService.validate_user
+for one token with the session cache on and off. Results are emitted as JSON, and
+--compare prints the median ratio against an earlier results file.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+# The services read these at import time, only the session benchmark signs tokens
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+os.environ.setdefault("WS_SECRET_KEY", "benchmark")
+os.environ.setdefault("WS_ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+os.environ.setdefault("RUN_TG", "FALSE")
+# The stub server is a single host, the per-host rate limit would measure itself rather than the cycle
+os.environ.setdefault("EBAY_REQUESTS_PER_SECOND", "100000")
+os.environ.setdefault("EBAY_BURST", "100000")
+
+import data
+from checker import Checker
+from corpus import load_corpus
+from migrations import run_migrations
+from parser import ListingParser
+from parser_engines import get_engine
+from repository.listing_repository import ListingRepository
+from services.auth_service import AuthService
+from session_cache import session_cache
+from stub_server import base_url, start_stub_server
+
+BENCH_USER_ID = "benchmark-user"
+OTHER_USER_ID = "benchmark-other-user"
+# Listings tracked by someone else in the per-user benchmark, so the user's slice is a small part of the table
+OTHER_USER_LISTINGS = 10000
+PRICE_POINTS_PER_LISTING = 3
+
+
+def summarize(name: str, params: dict, timings: list) -> dict:
+    return {
+        "name": name,
+        "params": params,
+        "runs": len(timings),
+        "seconds": {
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "mean": statistics.mean(timings),
+        },
+    }
+
+
+def measure(fn, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def measure_async(fn, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            await fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def parse_or_error(parse):
+    try:
+        return parse()
+    except Exception as e:
+        return e
+
+
+def bench_parsing(repeat: int) -> list:
+    results = []
+    corpus = load_corpus()
+    for engine_name in ("lxml", "bs4"):
+        engine = get_engine(engine_name)
+        if engine.name != engine_name:
+            continue
+        for fast_refresh in (True, False):
+            parser = ListingParser(engine, fast_refresh=fast_refresh)
+            for page_name, html in corpus.items():
+                response = SimpleNamespace(text=html, url="https://www.ebay.com/itm/404300336661")
+                timings = measure(lambda: parse_or_error(lambda: parser.parse_listing(response)), repeat)
+                results.append(summarize("parse_listing", {"engine": engine_name, "fast_refresh": fast_refresh, "page": page_name}, timings))
+        parser = ListingParser(engine)
+        response = SimpleNamespace(text=corpus["in_stock"], url="https://www.ebay.com/itm/404300336661")
+        timings = measure(lambda: parser.parse_listing_details(response, True), repeat)
+        results.append(summarize("parse_listing_details", {"engine": engine_name, "page": "in_stock"}, timings))
+    return results
+
+
+@contextlib.asynccontextmanager
+async def scratch_database():
+    with tempfile.TemporaryDirectory() as directory:
+        data.pool = data.ConnectionPool(os.path.join(directory, "benchmark.db"), data.DB_READERS)
+        await data.open_pool()
+        await data.init_db()
+        await run_migrations()
+        try:
+            yield
+        finally:
+            await data.close_pool()
+
+
+async def seed_listings(count: int, url_for, user_id: str = BENCH_USER_ID, first_id: int = 100000000000):
+    start = datetime(2025, 1, 1)
+    listings = [(str(first_id + i), f"Benchmark listing {i}", url_for(first_id + i), i % 20) for i in range(count)]
+    await data.execute_query_many("INSERT INTO listings (id, title, url, stock) VALUES (?, ?, ?, ?)", listings)
+    await data.execute_query_many("INSERT INTO listing_relations (id, user_id, listing_id) VALUES (?, ?, ?)",
+                                  [(f"rel-{listing[0]}", user_id, listing[0]) for listing in listings])
+    price_points = []
+    for listing in listings:
+        for point in range(PRICE_POINTS_PER_LISTING):
+            date = (start + timedelta(days=point)).isoformat()
+            price_points.append((listing[0], 100.0 + point, date, "US", listing[3], date))
+    await data.execute_query_many("INSERT INTO price_history (listing_id, price, date, currency, stock, last_seen) VALUES (?, ?, ?, ?, ?, ?)", price_points)
+    last_date = (start + timedelta(days=PRICE_POINTS_PER_LISTING - 1)).isoformat()
+    await data.execute_query_many("INSERT INTO listing_latest (listing_id, price, currency, previous_price, last_price_change, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(listing[0], 100.0 + PRICE_POINTS_PER_LISTING - 1, "US", 100.0 + PRICE_POINTS_PER_LISTING - 2, 1.0, last_date) for listing in listings])
+    return listings
+
+
+async def bench_repository(sizes: list, repeat: int) -> list:
+    results = []
+    for size in sizes:
+        async with scratch_database():
+            listings = await seed_listings(size, lambda id: f"https://www.ebay.com/itm/{id}")
+            repository = ListingRepository()
+            queries = {
+                "get_all_listings_display": repository.get_all_listings_display,
+                "get_all_listings_by_user_id": lambda: repository.get_all_listings_by_user_id(BENCH_USER_ID),
+                "get_all_listings": repository.get_all_listings,
+                "get_listing_by_url": lambda: repository.get_listing_by_url(listings[size // 2][2]),
+            }
+            for name, query in queries.items():
+                timings = await measure_async(query, repeat)
+                results.append(summarize(f"ListingRepository.{name}", {"listings": size}, timings))
+    return results
+
+
+async def bench_user_listings(user_sizes: list, repeat: int) -> list:
+    """GET /api/listings' query for a user tracking N listings, next to another user's OTHER_USER_LISTINGS"""
+    results = []
+    for size in user_sizes:
+        async with scratch_database():
+            await seed_listings(OTHER_USER_LISTINGS, lambda id: f"https://www.ebay.com/itm/{id}", OTHER_USER_ID)
+            await seed_listings(size, lambda id: f"https://www.ebay.com/itm/{id}", BENCH_USER_ID, 200000000000)
+            repository = ListingRepository()
+            timings = await measure_async(lambda: repository.get_all_listings_by_user_id(BENCH_USER_ID), repeat)
+            results.append(summarize("ListingRepository.get_all_listings_by_user_id", {"listings_per_user": size, "listings": size + OTHER_USER_LISTINGS}, timings))
+    return results
+
+
+class StubChecker(Checker):
+    """The stub server isn't on an ebay.* host"""
+    def validate_url(self, url: str) -> bool:
+        return True
+
+
+async def bench_refresh_cycle(listings: int, delay: float, repeat: int) -> list:
+    body = load_corpus()["in_stock"].encode("utf-8")
+    server = start_stub_server(lambda path: body, delay)
+    try:
+        async with scratch_database():
+            await seed_listings(listings, lambda id: f"{base_url(server)}/itm/{id}")
+            checker = StubChecker()
+            timings = await measure_async(checker.update_listings, repeat)
+            await checker.ebay.close()
+    finally:
+        server.shutdown()
+    return [summarize("Checker.update_listings", {"listings": listings, "delay_ms": delay * 1000, "concurrency": checker.ebay.max_concurrency}, timings)]
+
+
+async def bench_session_validation(repeat: int) -> list:
+    """The validate_user dependency every authenticated request runs, polling with one token"""
+    results = []
+    async with scratch_database():
+        await data.execute_query("INSERT INTO users (id, email, password) VALUES (?, ?, ?)", (BENCH_USER_ID, "bench@example.com", "$2b$12$" + "x" * 53))
+        auth_service = AuthService()
+        token = auth_service.generate_session_token("bench@example.com", BENCH_USER_ID)
+        calls = 1000
+        for cache_size in (0, session_cache.size):
+            session_cache.size, session_cache.hits, session_cache.misses = cache_size, 0, 0
+            session_cache.entries.clear()
+            session_cache.keys_by_user.clear()
+
+            async def validate_many():
+                for _ in range(calls):
+                    await auth_service.validate_user(token)
+            timings = await measure_async(validate_many, repeat)
+            result = summarize("AuthService.validate_user", {"calls": calls, "cache": cache_size > 0}, timings)
+            result["user_lookups"] = session_cache.misses
+            results.append(result)
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def result_key(result: dict) -> str:
+    return result["name"] + json.dumps(result["params"], sort_keys=True)
+
+
+def print_comparison(results: list, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = {result_key(result): result for result in json.load(file)["results"]}
+    for result in results:
+        previous = baseline.get(result_key(result))
+        if not previous:
+            continue
+        ratio = result["seconds"]["median"] / previous["seconds"]["median"]
+        print(f"{ratio:6.2f}x  {result['name']} {json.dumps(result['params'], sort_keys=True)}", file=sys.stderr)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--only", choices=["parse", "cycle", "repository", "auth"], action="append", help="run only these groups")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--sizes", default="1000,10000,100000", help="listing counts for the repository queries")
+    arg_parser.add_argument("--user-sizes", default="10,100,1000", help="listings tracked by the user in the per-user listing query")
+    arg_parser.add_argument("--cycle-listings", type=int, default=200)
+    arg_parser.add_argument("--cycle-delay-ms", type=int, default=50)
+    arg_parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    arg_parser.add_argument("--compare", help="earlier JSON results to compare medians against")
+    args = arg_parser.parse_args()
+    groups = args.only or ["parse", "cycle", "repository", "auth"]
+
+    results = []
+    if "parse" in groups:
+        results += bench_parsing(args.repeat)
+    if "cycle" in groups:
+        results += asyncio.run(bench_refresh_cycle(args.cycle_listings, args.cycle_delay_ms / 1000, min(args.repeat, 3)))
+    if "repository" in groups:
+        sizes = [int(size) for size in args.sizes.split(",")]
+        results += asyncio.run(bench_repository(sizes, min(args.repeat, 3)))
+        user_sizes = [int(size) for size in args.user_sizes.split(",")]
+        results += asyncio.run(bench_user_listings(user_sizes, args.repeat))
+    if "auth" in groups:
+        results += asyncio.run(bench_session_validation(args.repeat))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created_at": datetime.now().isoformat(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,114 +1,272 @@
 import json
+import os
 
 from fastapi.encoders import jsonable_encoder
-from classes import InsertPriceHistory, SelectListing, Settings
-from ebay import Ebay
+from classes import InsertPriceHistory, SelectListing
+from data import WRITE_PRIORITY_API
+from ebay import ebay_client
 import time
 import asyncio
 import logging
-from typing import List, Optional
+from collections import defaultdict
+from typing import Dict, List, Optional
 
+from persist_batcher import PersistBatcher
+from relation_index import relation_index
+from reminder_rules import reminder_index
+from resource_versions import LISTINGS, NEXT_UPDATE, resource_versions
 from repository.listing_relations_repository import ListingRelationsRepository
+from scheduler import RefreshScheduler, ScheduledListing
 from services.price_history_service import PriceHistoryService
 from services.reminder_service import ReminderService
 from services.listing_service import ListingService
 from services.settings_service import SettingsService
 from services.ws_service import ws_service 
 
+# How often the schedule is reconciled with listings, relations and settings in the database
+SCHEDULER_SYNC_SECONDS = int(os.getenv("SCHEDULER_SYNC_SECONDS") or 30)
+# Listings refreshed at the same time
+REFRESH_MAX_IN_FLIGHT = int(os.getenv("REFRESH_MAX_IN_FLIGHT") or 20)
+BROADCAST_INTERVAL_SECONDS = 5
+# Online users get their full listing list this often on top of the deltas, to resync anything missed
+WS_SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("WS_SNAPSHOT_INTERVAL_SECONDS") or 300)
+MAX_IDLE_SECONDS = 5
+
 class Checker:
     def __init__(self):
-        self.ebay = Ebay()
-        self.settings = Settings(interval=20, phone_number="", telegram_userid="", email="", user_id="") 
-        self.next_update = int(time.time() + self.settings.interval)
+        self.ebay = ebay_client
+        self.scheduler = RefreshScheduler()
+        # Refreshes dispatched and not finished yet, at most REFRESH_MAX_IN_FLIGHT
+        self.refreshes_in_flight = 0
+        self.refresh_tasks = set()
+        self.wakeup = asyncio.Event()
+        self.next_sync = 0
+        self.last_broadcast = 0
+        # Change set since the last broadcast: listing id -> changed display fields
+        self.pending_changes: Dict[str, dict] = {}
+        self.snapshot_sent_at: Dict[str, float] = {}
         self.logger = logging.getLogger(__name__)
         self.reminder_service = ReminderService()
         self.listing_service = ListingService()
         self.settings_service = SettingsService()
         self.price_history_service = PriceHistoryService()
+        # Refresh results are written one transaction per batch rather than several commits per listing
+        self.persist_batcher = PersistBatcher(self.listing_service.persist_listings)
 
-    async def refresh_settings(self):
-        self.settings = await self.settings_service.settings_repository.get_settings()
+    async def get_next_update(self, user_id: str):
+        settings = await self.settings_service.settings_repository.get_settings_by_user_id(user_id)
+        next_update = self.scheduler.next_due_for(relation_index.listings_of(user_id))
+        return int(next_update or time.time() + settings.interval), settings.interval
 
-    async def get_next_update(self):
-        return self.next_update, self.settings.interval
-    
-    async def set_next_update(self):
-        await self.refresh_settings()
-        self.next_update = int(time.time() + self.settings.interval)
+    def next_update_etag(self, user_id: str) -> str:
+        """Changes with the user's settings and the due time of their next refresh"""
+        next_update = self.scheduler.next_due_for(relation_index.listings_of(user_id))
+        # Without scheduled listings the answer is "now + interval", which moves every second
+        return resource_versions.etag(user_id, NEXT_UPDATE, int(next_update or time.time()))
+
+    def request_schedule_sync(self):
+        """Reconcile the schedule on the next loop iteration, after listings or settings changed"""
+        self.next_sync = 0
+        self.wakeup.set()
+
+    async def sync_schedule(self):
+        await self.reminder_service.load_reminders()
+        targets = await self.listing_service.listing_repository.get_refresh_targets()
+        reminder_listing_ids = reminder_index.listing_ids()
+        relation_index.load(await ListingRelationsRepository().get_all_listing_relations())
+        self.scheduler.sync(targets, time.time(), reminder_listing_ids)
+        self.next_sync = time.time() + SCHEDULER_SYNC_SECONDS
 
     async def update_loop(self):
         while True:
             try:
-                sleep_time = max(0, self.next_update - time.time())
-                self.logger.info(f"Sleeping for {sleep_time} seconds")
-                await asyncio.sleep(sleep_time)
-                await self.set_next_update()
-                await self.update_listings()
+                if time.time() >= self.next_sync:
+                    await self.sync_schedule()
+                # While eBay serves captchas nothing is dispatched, due listings wait for the circuit to close.
+                # Only as many are popped as can start right away, the rest stay queued and the breaker,
+                # schedule sync and broadcasts get another look before they're dispatched.
+                free_slots = REFRESH_MAX_IN_FLIGHT - self.refreshes_in_flight
+                due = [] if self.ebay.governor.breaker.is_open() or free_slots <= 0 else self.scheduler.pop_due(time.time(), free_slots)
+                for entry in due:
+                    self.refreshes_in_flight += 1
+                    task = asyncio.create_task(self.refresh_scheduled_listing(entry))
+                    self.refresh_tasks.add(task)
+                    task.add_done_callback(self.refresh_tasks.discard)
+                since_broadcast = time.time() - self.last_broadcast
+                if (self.pending_changes and since_broadcast >= BROADCAST_INTERVAL_SECONDS) or since_broadcast >= WS_SNAPSHOT_INTERVAL_SECONDS:
+                    self.last_broadcast = time.time()
+                    await self.broadcast_updates()
+                await self.wait_for_next_due()
             except Exception as e:
                 self.logger.error(f"Error in update loop: {str(e)}")
                 await asyncio.sleep(10)  # Prevent tight loop on error
+
+    async def wait_for_next_due(self):
+        now = time.time()
+        next_due = self.scheduler.next_due()
+        if self.refreshes_in_flight >= REFRESH_MAX_IN_FLIGHT:
+            # Nothing more can start until a refresh finishes, which sets wakeup
+            next_due = None
+        if next_due is not None and self.ebay.governor.breaker.is_open(now):
+            next_due = max(next_due, self.ebay.governor.breaker.open_until)
+        wake_at = min(x for x in (next_due, self.next_sync, now + MAX_IDLE_SECONDS) if x is not None)
+        if self.pending_changes:
+            wake_at = min(wake_at, self.last_broadcast + BROADCAST_INTERVAL_SECONDS)
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout=max(0, wake_at - now))
+        except asyncio.TimeoutError:
+            pass
+
+    async def refresh_scheduled_listing(self, entry: ScheduledListing):
+        changed = False
+        stock = None
+        # Captchas, an open circuit, timeouts and server errors say nothing about how often the listing changes
+        failed = True
+        try:
+            existing_listing = await self.listing_service.listing_repository.get_listing_by_id(entry.listing_id)
+            result = await self.add_or_update_listing(entry.url, existing_listing, None)
+            if result:
+                changed = result['changed']
+                stock = result['stock']
+                failed = False
+        except Exception as e:
+            self.logger.error(f"Failed to update listing {entry.url}: {str(e)}")
+        finally:
+            self.scheduler.complete(entry.listing_id, time.time(), changed, stock, failed)
+            self.refreshes_in_flight -= 1
+            self.wakeup.set()
     
+    async def close(self):
+        """Stop refreshes in progress and write out what they already parsed, before the pool closes"""
+        for task in self.refresh_tasks:
+            task.cancel()
+        if self.refresh_tasks:
+            await asyncio.gather(*self.refresh_tasks, return_exceptions=True)
+        await self.persist_batcher.drain()
+
     async def delete_listing(self, id: str):
         await self.listing_service.listing_repository.delete_listing(id)
 
     async def update_listings(self):
-        await self.reminder_service.update_reminders()
+        """Refresh every listing at once, outside the schedule"""
+        await self.reminder_service.load_reminders()
         listings = await self.listing_service.listing_repository.get_all_listings()
+        # Every listing flows through fetch -> parse -> persist on its own, so the stages overlap:
+        # fetches are bounded by the Ebay client's concurrency limit and parsing runs in the parse pool
         promises = []
         for listing in listings:
             promises.append(self.add_or_update_listing(listing.url, listing, None))
         results = await asyncio.gather(*promises, return_exceptions=True)
-        for result in results:
-            if result:
-                if result == BaseException:
-                    print(str(result))
+        for listing, result in zip(listings, results):
+            if isinstance(result, BaseException):
+                self.logger.error(f"Failed to update listing {listing.url}: {str(result)}")
+            elif result:
                 print(f"Upserted listing {listing.url} with id {result['id']}")
         await self.broadcast_updates()
 
     async def broadcast_updates(self):
-        ### Only send updates to correct users
-        all_listings = await self.listing_service.listing_repository.get_all_listings_display()
-        all_listing_relations = await ListingRelationsRepository().get_all_listing_relations()
-        current_online_users = ws_service.get_online_users()
-        for user in current_online_users:
-            listing_relations = [x['listing_id'] for x in all_listing_relations if x['user_id'] == user]
-            ## Pick out matching listings
-            listings = [x for x in all_listings if x.id in listing_relations]
-            listings = [jsonable_encoder(x) for x in listings]
-            if listings:
-                js = {"type": "update", "body": listings}
-                await ws_service.send_message(user, js)
+        """Send every online user the changed fields of the listings they track. Users whose last full
+        snapshot is older than WS_SNAPSHOT_INTERVAL_SECONDS get their whole list instead."""
+        changes, self.pending_changes = self.pending_changes, {}
+        online_users = set(ws_service.get_online_users())
+        for user_id in [user_id for user_id in self.snapshot_sent_at if user_id not in online_users]:
+            del self.snapshot_sent_at[user_id]
+        deltas = defaultdict(list)
+        for listing_id, fields in changes.items():
+            for user_id in relation_index.users_of([listing_id]) & online_users:
+                deltas[user_id].append({"id": listing_id, **fields})
+        now = time.time()
+        for user_id in online_users:
+            if now - self.snapshot_sent_at.get(user_id, 0) >= WS_SNAPSHOT_INTERVAL_SECONDS:
+                await self.send_snapshot(user_id)
+            elif deltas.get(user_id):
+                await ws_service.send_message(user_id, {"type": "delta", "body": deltas[user_id]})
+
+    async def send_snapshot(self, user_id: str):
+        """Every listing the user tracks, sent on connect and periodically after that"""
+        listings = await self.listing_service.listing_repository.get_all_listings_by_user_id(user_id)
+        await ws_service.send_message(user_id, {"type": "update", "body": jsonable_encoder(listings)})
+        self.snapshot_sent_at[user_id] = time.time()
     
     async def add_or_update_listing(self, url: str, existing_listing: Optional[SelectListing], user_id: Optional[str]):
         if not self.validate_url(url):
             self.logger.error(f"Invalid eBay URL: {url}")
             return None
-        parsed_listing = self.ebay.get_listing(url)
-        if existing_listing:
-            await self.reminder_service.reminder_repository.get_reminders_by_target_product_id(existing_listing.id, True)
-            await self.reminder_service.remind_stock_status(existing_listing, parsed_listing)
-            
+        # Fetch and parse stages, shared with any concurrent request for the same item
+        parsed_listing = await self.ebay.get_listing(url)
+        return await self.persist_listing(parsed_listing, existing_listing, user_id)
+
+    async def persist_listing(self, parsed_listing: Optional[SelectListing], existing_listing: Optional[SelectListing], user_id: Optional[str]):
+        """Persist stage: store a parsed listing and fire its reminders"""
         if parsed_listing:
-            await self.listing_service.listing_repository.upsert_listing(parsed_listing, user_id)
+            if user_id:
+                # Added by a user who is waiting on the response, no point holding it for a batch
+                await self.listing_service.persist_listings([(parsed_listing, user_id)], WRITE_PRIORITY_API)
+            else:
+                await self.persist_batcher.submit((parsed_listing, user_id))
             
             listing_id = parsed_listing.id
             was_inserted = not existing_listing 
-            
-            if parsed_listing.price_history:
-                for price_history in parsed_listing.price_history:
-                    insert_id = await self.add_price_history(parsed_listing.id, price_history)
-                    print(f"Inserted price history with id: {insert_id}")
+            changed_fields = self.changed_fields(existing_listing, parsed_listing)
+            if changed_fields:
+                self.pending_changes.setdefault(listing_id, {}).update(changed_fields)
+            changed = self.has_changed(existing_listing, parsed_listing) or bool(changed_fields)
+            if existing_listing and changed:
+                await self.reminder_service.remind_changes(existing_listing, parsed_listing)
+            if user_id:
+                relation_index.add(user_id, listing_id)
+                resource_versions.bump([user_id], LISTINGS)
+            if changed:
+                resource_versions.bump(relation_index.users_of([listing_id]) - {user_id}, LISTINGS)
             
             return {
                 "id": listing_id,
-                "action": "inserted" if was_inserted else "updated"
+                "action": "inserted" if was_inserted else "updated",
+                "changed": changed,
+                "stock": parsed_listing.stock
             }
         else:
             return None
     
 
-    async def add_price_history(self, listing_id: str, pricehistory: InsertPriceHistory):
-        insert_id = await self.price_history_service.price_history_repository.add_price_history(listing_id, pricehistory)
+    def has_changed(self, existing_listing: Optional[SelectListing], parsed_listing: SelectListing) -> bool:
+        """Whether stock or the current price moved since the stored state"""
+        if not existing_listing:
+            return True
+        if existing_listing.stock != parsed_listing.stock:
+            return True
+        old_price = existing_listing.price_history[0] if existing_listing.price_history else None
+        new_price = parsed_listing.price_history[0] if parsed_listing.price_history else None
+        if old_price is None or new_price is None:
+            return old_price is not new_price
+        return (old_price.price, old_price.currency) != (new_price.price, new_price.currency)
+
+    def changed_fields(self, existing_listing: Optional[SelectListing], parsed_listing: SelectListing) -> dict:
+        """Display fields that differ from the stored state, all of them for a new listing"""
+        new_price = parsed_listing.price_history[0] if parsed_listing.price_history else None
+        if not existing_listing:
+            return {
+                "title": parsed_listing.title,
+                "url": parsed_listing.url,
+                "stock": parsed_listing.stock,
+                "price": new_price.price if new_price else 0,
+                "last_price_change": 0
+            }
+        fields = {}
+        if existing_listing.title != parsed_listing.title:
+            fields["title"] = parsed_listing.title
+        if existing_listing.stock != parsed_listing.stock:
+            fields["stock"] = parsed_listing.stock
+        old_price = existing_listing.price_history[0] if existing_listing.price_history else None
+        if new_price and (old_price is None or old_price.price != new_price.price):
+            fields["price"] = new_price.price
+            fields["last_price_change"] = new_price.price - old_price.price if old_price else 0
+        return fields
+
+    async def add_price_history(self, listing_id: str, pricehistory: InsertPriceHistory, stock: Optional[int] = None):
+        insert_id = await self.price_history_service.price_history_repository.add_price_history(listing_id, pricehistory, stock)
+        await self.price_history_service.listing_latest_repository.update_latest(listing_id, pricehistory)
         return insert_id
 
     async def add_price_histories(self, listing_id: str, 
@@ -1,7 +1,7 @@
 
 from datetime import datetime
 from pydantic import BaseModel
-from typing import List
+from typing import List, NamedTuple, Optional
 
 class InsertPriceHistory(BaseModel):
     price: float
@@ -12,12 +12,14 @@ class SelectPriceHistory(BaseModel):
     price: float
     date: str
     currency: str
+    last_seen: Optional[str] = None
 
     def to_dict(self):
         return {
             "price": self.price,
             "date": self.date,
-            "currency": self.currency
+            "currency": self.currency,
+            "last_seen": self.last_seen
         }
 
 class InsertListing(BaseModel):
@@ -85,13 +87,17 @@ class SelectReminder(BaseModel):
     method: str
     target_product_id: str
     type: str
+    threshold: Optional[float] = None
+    user_id: Optional[str] = None
 
     def to_dict(self):
         return {
             "id": self.id,
             "method": self.method,
             "target_product_id": self.target_product_id,
-            "type": self.type
+            "type": self.type,
+            "threshold": self.threshold,
+            "user_id": self.user_id
         }
 
 
@@ -99,15 +105,47 @@ class InsertReminder(BaseModel):
     method: str
     target_product_id: str
     type: str
+    threshold: Optional[float] = None
+    user_id: Optional[str] = None
 
     def to_dict(self):
         return {
             "method": self.method,
             "target_product_id": self.target_product_id,
-            "type": self.type
+            "type": self.type,
+            "threshold": self.threshold,
+            "user_id": self.user_id
         }
 
 
+class ListingQuery(BaseModel):
+    """Paging, sorting, filtering and field selection for a user's listings"""
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+    sort: str = "created_at"
+    descending: bool = True
+    in_stock: Optional[bool] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    changed_since: Optional[datetime] = None
+    fields: Optional[List[str]] = None
+
+
+class InsertNotification(BaseModel):
+    idempotency_key: str
+    channel: str
+    recipient: Optional[str] = None
+    message: str
+
+class SelectNotification(BaseModel):
+    id: int
+    idempotency_key: str
+    channel: str
+    recipient: Optional[str] = None
+    message: str
+    attempts: int
+
+
 class CustomDate(BaseModel):
     day: int
     month: int
@@ -131,6 +169,12 @@ class SelectUser(BaseModel):
     email: str
     created_at: datetime
 
+class Principal(NamedTuple):
+    """The authenticated user as request handlers see it, without the password hash"""
+    id: str
+    email: str
+    created_at: datetime
+
 class InsertUser(BaseModel):
     password: str
     email: str
@@ -0,0 +1,18 @@
+"""One-off compaction of price_history: collapses runs of unchanged observations into a single row.
+Usage: python compact_price_history.py"""
+import asyncio
+from data import close_pool, init_db, open_pool
+from migrations import run_migrations
+from repository.price_history_repository import PriceHistoryRepository
+
+
+async def main():
+    await open_pool()
+    await init_db()
+    await run_migrations()
+    deleted = await PriceHistoryRepository().compact_price_history()
+    print(f"Removed {deleted} duplicate price history rows")
+    await close_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,42 +1,211 @@
+import asyncio
+import itertools
+import logging
+import os
 import aiosqlite
-from typing import List, Optional, Any
+from typing import Any, Awaitable, Callable, List, Optional
 from contextlib import asynccontextmanager
 
-DATABASE_NAME = "listings.db"
+DATABASE_NAME = os.getenv("DATABASE_NAME") or "listings.db"
+DB_READERS = int(os.getenv("DB_READERS") or 4)
+DB_CACHED_STATEMENTS = 256
+# Queued writes committed together in one transaction
+WRITE_GROUP_MAX = int(os.getenv("WRITE_GROUP_MAX") or 64)
+
+# Queue priorities: request handlers go ahead of background refresh batches
+WRITE_PRIORITY_API = 0
+WRITE_PRIORITY_BACKGROUND = 1
+WRITE_PRIORITY_STOP = 2
+
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA mmap_size=268435456;",
+    "PRAGMA cache_size=-64000;",
+    "PRAGMA busy_timeout=5000;",
+]
 
 async def enable_wal_mode(db):
-    """Enable WAL mode for the SQLite database."""
-    await db.execute("PRAGMA journal_mode=WAL;")
-    print("WAL mode enabled.")
+    """Enable WAL mode and the rest of the connection pragmas for the SQLite database."""
+    for pragma in CONNECTION_PRAGMAS:
+        await db.execute(pragma)
+
+class ConnectionPool:
+    """Persistent connections: one writer guarded by a lock and N readers handed out through a queue.
+    Opened once at startup, sqlite3's statement cache keeps prepared statements per connection.
+    Writes go through a priority queue drained by a single writer task, see submit_write."""
+    def __init__(self, database: str, readers: int):
+        self.database = database
+        self.reader_count = readers
+        self.writer_connection: Optional[aiosqlite.Connection] = None
+        self.readers: Optional[asyncio.Queue] = None
+        self.reader_connections: List[aiosqlite.Connection] = []
+        self.write_lock = asyncio.Lock()
+        self.open_lock = asyncio.Lock()
+        self.write_queue: Optional[asyncio.PriorityQueue] = None
+        self.write_task: Optional[asyncio.Task] = None
+        self.write_sequence = itertools.count()
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def is_open(self) -> bool:
+        return self.writer_connection is not None
+
+    async def connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.database, cached_statements=DB_CACHED_STATEMENTS)
+        await enable_wal_mode(conn)
+        return conn
+
+    async def open(self):
+        async with self.open_lock:
+            if self.is_open:
+                return
+            # Writer first so WAL is set before the readers attach
+            self.writer_connection = await self.connect()
+            self.readers = asyncio.Queue()
+            for _ in range(self.reader_count):
+                conn = await self.connect()
+                self.reader_connections.append(conn)
+                self.readers.put_nowait(conn)
+
+    async def close(self):
+        await self.stop_writer()
+        async with self.open_lock:
+            for conn in self.reader_connections:
+                await conn.close()
+            self.reader_connections = []
+            self.readers = None
+            if self.writer_connection:
+                await self.writer_connection.close()
+                self.writer_connection = None
+
+    @asynccontextmanager
+    async def writer(self):
+        if not self.is_open:
+            await self.open()
+        async with self.write_lock:
+            yield self.writer_connection
+
+    @asynccontextmanager
+    async def reader(self):
+        if not self.is_open:
+            await self.open()
+        conn = await self.readers.get()
+        try:
+            yield conn
+        finally:
+            self.readers.put_nowait(conn)
+
+    def submit_write(self, operation: Callable[[aiosqlite.Connection], Awaitable[Any]], priority: int = WRITE_PRIORITY_API) -> asyncio.Future:
+        """Queue operation(conn) for the writer task, the future resolves with its return value once committed.
+        The operation runs inside the writer's transaction and must not queue writes itself."""
+        if self.write_task is None or self.write_task.done():
+            self.write_queue = asyncio.PriorityQueue()
+            self.write_task = asyncio.create_task(self.run_writer())
+        future = asyncio.get_running_loop().create_future()
+        self.write_queue.put_nowait((priority, next(self.write_sequence), operation, future))
+        return future
+
+    async def stop_writer(self):
+        """Let the writer finish what is queued, then stop it"""
+        if self.write_task is None or self.write_task.done():
+            return
+        self.write_queue.put_nowait((WRITE_PRIORITY_STOP, next(self.write_sequence), None, None))
+        await self.write_task
+        self.write_task = None
+
+    async def run_writer(self):
+        while True:
+            group = [await self.write_queue.get()]
+            # Group what is already queued at the same priority, a pending API write never waits behind
+            # more than the one background transaction already running
+            while len(group) < WRITE_GROUP_MAX and not self.write_queue.empty():
+                item = self.write_queue.get_nowait()
+                if item[0] != group[0][0]:
+                    self.write_queue.put_nowait(item)
+                    break
+                group.append(item)
+            if group[0][0] == WRITE_PRIORITY_STOP:
+                return
+            await self.write_group([(operation, future) for _, _, operation, future in group])
+
+    async def write_group(self, group: List[tuple]):
+        """One transaction for the group, a savepoint per operation so a failing one doesn't undo the rest"""
+        results = []
+        try:
+            async with self.writer() as conn:
+                await conn.execute("BEGIN")
+                try:
+                    for operation, future in group:
+                        await conn.execute("SAVEPOINT write_operation")
+                        try:
+                            results.append((future, await operation(conn), None))
+                        except Exception as e:
+                            await conn.execute("ROLLBACK TO write_operation")
+                            results.append((future, None, e))
+                        await conn.execute("RELEASE write_operation")
+                    await conn.commit()
+                except BaseException:
+                    await conn.rollback()
+                    raise
+        except Exception as e:
+            self.logger.error(f"Write transaction failed: {str(e)}")
+            results = [(future, None, e) for _, future in group]
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+pool = ConnectionPool(DATABASE_NAME, DB_READERS)
+
+async def open_pool():
+    await pool.open()
+
+async def close_pool():
+    await pool.close()
 
 @asynccontextmanager
 async def get_db_connection():
-    async with aiosqlite.connect(DATABASE_NAME) as conn:
+    async with pool.writer() as conn:
+        yield conn
+
+@asynccontextmanager
+async def get_read_connection():
+    async with pool.reader() as conn:
         yield conn
 
+async def run_in_transaction(operation: Callable[[aiosqlite.Connection], Awaitable[Any]], priority: int = WRITE_PRIORITY_API) -> Any:
+    """Run operation(conn) through the write queue and return its result once committed"""
+    return await pool.submit_write(operation, priority)
+
+async def execute_write(query: str, params: tuple = (), many: bool = False) -> aiosqlite.Cursor:
+    async def operation(conn: aiosqlite.Connection):
+        cursor = await (conn.executemany(query, params) if many else conn.execute(query, params))
+        await cursor.close()
+        return cursor
+    return await run_in_transaction(operation)
+
 async def execute_query(query: str, params: tuple = ()) -> int | None:
     """Execute a query without returning results"""
-    async with get_db_connection() as conn:
-        cursor = await conn.execute(query, params)
-        lastrowid = cursor.lastrowid
-        await cursor.close()  # Close the cursor before committing
-        await conn.commit()
-        return lastrowid
+    return (await execute_write(query, params)).lastrowid
 
 async def execute_query_many(query: str, params: tuple = ()) -> int | None:
     """Execute a query without returning results"""
-    async with get_db_connection() as conn:
-        cursor = await conn.executemany(query, params)
-        lastrowid = cursor.lastrowid
-        await cursor.close()
-        await conn.commit()
-        return lastrowid
+    return (await execute_write(query, params, many=True)).lastrowid
+
+async def execute_update(query: str, params: tuple = ()) -> int:
+    """Execute a query and return the number of affected rows"""
+    return (await execute_write(query, params)).rowcount
 
 async def select_one(query: str, params: tuple = (), as_dict: bool = False) -> Optional[tuple] | dict:
     """Execute a query and return a single row"""
-    async with get_db_connection() as conn:
+    async with get_read_connection() as conn:
         cursor = await conn.execute(query, params)
         fetched = await  cursor.fetchone()
+        await cursor.close()
         if fetched and as_dict:
             columns = [desc[0] for desc in cursor.description]
             return dict(zip(columns, fetched))
@@ -44,14 +213,15 @@ async def select_one(query: str, params: tuple = (), as_dict: bool = False) -> O
 
 async def select_all(query: str, params: tuple = (), as_dict: bool = False) -> List[tuple] | List[dict]:
     """Execute a query and return all rows"""
-    async with get_db_connection() as conn:
+    async with get_read_connection() as conn:
         cursor = await conn.execute(query, params)
+        rows = await cursor.fetchall()
+        await cursor.close()
         if as_dict:
-            rows = await cursor.fetchall()
             columns = [column[0] for column in cursor.description]
             return [dict(zip(columns, row)) for row in rows]
         else:
-            return await cursor.fetchall()
+            return rows
 
 def dict_factory(cursor: aiosqlite.Cursor, row: tuple) -> dict:
     """Convert a row to a dictionary using column names as keys"""
@@ -60,17 +230,11 @@ def dict_factory(cursor: aiosqlite.Cursor, row: tuple) -> dict:
 
 async def select_one_dict(query: str, params: tuple = ()) -> Optional[dict]:
     """Execute a query and return a single row as dictionary"""
-    async with get_db_connection() as conn:
-        conn.row_factory = dict_factory
-        cursor = await conn.execute(query, params)
-        return await cursor.fetchone()
+    return await select_one(query, params, as_dict=True)
 
 async def select_all_dict(query: str, params: tuple = ()) -> List[dict]:
     """Execute a query and return all rows as dictionaries"""
-    async with get_db_connection() as conn:
-        conn.row_factory = dict_factory
-        cursor = await conn.execute(query, params)
-        return await cursor.fetchall()
+    return await select_all(query, params, as_dict=True)
 
 # Initialize database and create tables
 async def init_db():
@@ -0,0 +1,71 @@
+import gzip
+import os
+import time
+from collections import deque
+from typing import Deque, List, NamedTuple, Optional
+
+# Number of failed pages to keep, 0 disables snapshots entirely
+DEBUG_SNAPSHOTS = int(os.getenv("DEBUG_SNAPSHOTS") or 0)
+# Optional directory to also write the snapshots to as .html.gz files
+DEBUG_SNAPSHOT_DIR = os.getenv("DEBUG_SNAPSHOT_DIR")
+
+class Snapshot(NamedTuple):
+    taken_at: float
+    url: str
+    reason: str
+    html_gz: bytes
+
+    def html(self) -> str:
+        return gzip.decompress(self.html_gz).decode("utf-8")
+
+class SnapshotBuffer:
+    """Bounded ring buffer of compressed raw HTML for pages that failed to parse"""
+    def __init__(self, size: int = DEBUG_SNAPSHOTS, directory: Optional[str] = DEBUG_SNAPSHOT_DIR):
+        self.size = size
+        self.directory = directory
+        self.snapshots: Deque[Snapshot] = deque(maxlen=size if size > 0 else None)
+        self.files: Deque[str] = deque()
+        self.files_loaded = False
+        self.sequence = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def record(self, url: str, reason: str, html: str):
+        if not self.enabled:
+            return
+        snapshot = Snapshot(taken_at=time.time(), url=url, reason=reason, html_gz=gzip.compress(html.encode("utf-8"), compresslevel=6))
+        self.snapshots.append(snapshot)
+        if self.directory:
+            self.write_file(snapshot)
+
+    def load_files(self):
+        """Pick up snapshots written before a restart, so pruning keeps the directory bounded across runs"""
+        os.makedirs(self.directory, exist_ok=True)
+        existing = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".html.gz")]
+        self.files = deque(sorted(existing, key=os.path.getmtime))
+        self.files_loaded = True
+
+    def write_file(self, snapshot: Snapshot):
+        if not self.files_loaded:
+            self.load_files()
+        self.sequence += 1
+        filename = os.path.join(self.directory, f"{int(snapshot.taken_at * 1000)}_{self.sequence}_{snapshot.reason}.html.gz")
+        with open(filename, "wb") as file:
+            file.write(snapshot.html_gz)
+        self.files.append(filename)
+        while len(self.files) > self.size:
+            oldest = self.files.popleft()
+            if os.path.exists(oldest):
+                os.remove(oldest)
+
+    def get_snapshots(self) -> List[Snapshot]:
+        return list(self.snapshots)
+
+    def get_snapshot(self, index: int) -> Optional[Snapshot]:
+        """By position in get_snapshots(), oldest first"""
+        snapshots = self.get_snapshots()
+        return snapshots[index] if 0 <= index < len(snapshots) else None
+
+snapshot_buffer = SnapshotBuffer()
@@ -1,30 +1,102 @@
+import asyncio
+import os
+from typing import Dict, Optional, Tuple
 from curl_cffi import requests
 from classes import SelectListing
-from errors import InvalidUrlError, ListingNotFoundError
-from parser import ListingParser
+from ebay_urls import canonicalize_url, get_item_id
+from debug_snapshots import snapshot_buffer
+from errors import CaptchaError, InvalidUrlError, ListingNotFoundError
+from fetch_governor import CAPTCHA, ERROR, OK, THROTTLED, FetchGovernor
+from parser import CAPTCHA_MARKER, ListingParser
+from parse_pool import ParsePool
+
+EBAY_MAX_CONCURRENCY = int(os.getenv("EBAY_MAX_CONCURRENCY") or 10)
 
 class Ebay:
-    def __init__(self):
+    def __init__(self, max_concurrency: int = EBAY_MAX_CONCURRENCY):
         self.parser = ListingParser()
+        self.parse_pool = ParsePool()
+        self.max_concurrency = max_concurrency
+        self.session: Optional[requests.AsyncSession] = None
+        # Per-host rate limit, adaptive concurrency and the captcha circuit breaker
+        self.governor = FetchGovernor(max_concurrency)
+        # Item id -> the one fetch and parse every concurrent caller for that item awaits
+        self.in_flight: Dict[str, asyncio.Future] = {}
+
+    def get_session(self) -> requests.AsyncSession:
+        """Shared session, created lazily so it binds to the running event loop"""
+        if self.session is None:
+            self.session = requests.AsyncSession(impersonate="chrome", max_clients=self.max_concurrency)
+        return self.session
+
+    async def close(self):
+        self.parse_pool.close()
+        if self.session:
+            await self.session.close()
+            self.session = None
 
-    def get_response(self, url: str) -> requests.Response:
+    async def get_response(self, url: str) -> requests.Response:
+        session = self.get_session()
+        await self.governor.acquire(url)
+        outcome = ERROR
         try:
-            response = requests.get(url, impersonate="chrome")
+            response = await session.get(url)
             response.raise_for_status()
+            if CAPTCHA_MARKER.encode() in response.content:
+                outcome = CAPTCHA
+                snapshot_buffer.record(url, "captcha", response.text)
+                raise CaptchaError(f"Captcha detected: {url}")
+            outcome = OK
             return response
         except requests.exceptions.RequestException as e:
-            if e.response.status_code == 404:
+            status_code = e.response.status_code if e.response is not None else None
+            if status_code == 404:
+                outcome = OK
                 raise ListingNotFoundError(f"Listing not found: {url}")
-            elif e.response.status_code == 400:
+            elif status_code == 400:
+                outcome = OK
                 raise InvalidUrlError(f"Invalid URL: {url}")
-            else:
-                raise e
+            elif status_code == 429 or (status_code is not None and status_code >= 500):
+                outcome = THROTTLED
+            raise e
+        finally:
+            self.governor.release(outcome)
+
+    async def fetch_page(self, url: str) -> Tuple[str, bytes]:
+        """Fetch stage: final URL and raw page bytes"""
+        response = await self.get_response(url)
+        return response.url, response.content
+
+    async def parse_page(self, url: str, content: bytes) -> SelectListing:
+        """Parse stage: runs in the parse pool's worker processes"""
+        return await self.parse_pool.parse_listing(url, content)
 
-    def get_listing(self, url: str) -> SelectListing:
-        response = self.get_response(url)
-        return self.parser.parse_listing(response)
-    
+    async def get_listing(self, url: str) -> SelectListing:
+        """Fetch and parse a listing, concurrent calls for the same item share one request"""
+        canonical_url = canonicalize_url(url)
+        key = get_item_id(canonical_url) or canonical_url
+        in_flight = self.in_flight.get(key)
+        if in_flight is None:
+            in_flight = asyncio.ensure_future(self.fetch_listing(canonical_url))
+            self.in_flight[key] = in_flight
+            in_flight.add_done_callback(lambda future: self.release_in_flight(key, future))
+        # Shielded so a caller giving up doesn't cancel the fetch for everyone else
+        return await asyncio.shield(in_flight)
 
-    def get_listing_details(self, url: str, download_images: bool):
-        response = self.get_response(url)
+    def release_in_flight(self, key: str, future: asyncio.Future):
+        if self.in_flight.get(key) is future:
+            del self.in_flight[key]
+        if not future.cancelled():
+            future.exception()  # retrieved here too, in case every caller was cancelled
+
+    async def fetch_listing(self, canonical_url: str) -> SelectListing:
+        _, content = await self.fetch_page(canonical_url)
+        # Keep the canonical URL rather than wherever eBay redirected to, it's what gets stored and refreshed
+        return await self.parse_page(canonical_url, content)
+
+
+    async def get_listing_details(self, url: str, download_images: bool):
+        response = await self.get_response(url)
         return self.parser.parse_listing_details(response, download_images)
+
+ebay_client = Ebay()
@@ -0,0 +1,20 @@
+import re
+from typing import Optional
+from urllib.parse import urlsplit
+
+ITEM_ID_PATTERN = re.compile(r"/itm/(?:[^/?#]+/)?(\d{9,15})(?:[/?#]|$)")
+EBAY_HOST_PATTERN = re.compile(r"^(?:www\.)?ebay\.([a-z.]+)$")
+
+def get_item_id(url: str) -> Optional[str]:
+    """eBay item id from any item URL variant: with a title slug, query string, tracking params or fragment"""
+    match = ITEM_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+def canonicalize_url(url: str) -> str:
+    """https://www.ebay.<tld>/itm/<item id>, or the url without whitespace when it isn't a recognizable item URL"""
+    cleaned_url = ''.join(char for char in url if not char.isspace())
+    item_id = get_item_id(cleaned_url)
+    host_match = EBAY_HOST_PATTERN.match(urlsplit(cleaned_url).hostname or "")
+    if not item_id or not host_match:
+        return cleaned_url
+    return f"https://www.ebay.{host_match.group(1)}/itm/{item_id}"
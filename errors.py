@@ -5,4 +5,11 @@ class InvalidUrlError(Exception):
 class ListingNotFoundError(Exception):
     pass
 
+class CaptchaError(Exception):
+    pass
+
+class CircuitOpenError(Exception):
+    pass
 
+class PasswordBusyError(Exception):
+    pass
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+from urllib.parse import urlsplit
+from errors import CircuitOpenError
+
+# Sustained requests per second and burst size allowed per eBay host
+EBAY_REQUESTS_PER_SECOND = float(os.getenv("EBAY_REQUESTS_PER_SECOND") or 5)
+EBAY_BURST = int(os.getenv("EBAY_BURST") or 10)
+# Captcha share of recent responses that opens the circuit
+CAPTCHA_RATE_THRESHOLD = float(os.getenv("CAPTCHA_RATE_THRESHOLD") or 0.2)
+CAPTCHA_WINDOW = 20
+CAPTCHA_MIN_SAMPLES = 5
+CIRCUIT_COOLDOWN_SECONDS = 60
+CIRCUIT_MAX_COOLDOWN_SECONDS = 900
+
+# Outcomes reported back for every request
+OK = "ok"
+THROTTLED = "throttled"
+CAPTCHA = "captcha"
+ERROR = "error"
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        # The lock queues waiters so tokens are handed out in arrival order
+        async with self.lock:
+            self.refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit: +1 per limit's worth of successes, halved on throttling"""
+    def __init__(self, maximum: int, minimum: int = 1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.released = asyncio.Event()
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            self.released.clear()
+            await self.released.wait()
+        self.in_flight += 1
+
+    def release(self, outcome: str):
+        """Synchronous so it also runs from a cancelled request's cleanup"""
+        self.in_flight -= 1
+        if outcome in (THROTTLED, CAPTCHA):
+            self.limit = max(self.minimum, self.limit / 2)
+        elif outcome == OK:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self.released.set()
+
+class CircuitBreaker:
+    """Opens when the captcha rate over the recent window crosses the threshold. After the cooldown one
+    more captcha reopens it for twice as long, a success closes it again."""
+    def __init__(self):
+        self.outcomes: Deque[bool] = deque(maxlen=CAPTCHA_WINDOW)
+        self.open_until = 0.0
+        self.cooldown = CIRCUIT_COOLDOWN_SECONDS
+        self.tripped = False
+        self.logger = logging.getLogger(__name__)
+
+    def is_open(self, now: Optional[float] = None) -> bool:
+        return (now or time.time()) < self.open_until
+
+    def record(self, captcha: bool):
+        self.outcomes.append(captcha)
+        if self.tripped and not self.is_open():
+            # Half open: the first outcome after the cooldown decides
+            if captcha:
+                self.cooldown = min(self.cooldown * 2, CIRCUIT_MAX_COOLDOWN_SECONDS)
+                self.trip()
+            else:
+                self.tripped = False
+                self.cooldown = CIRCUIT_COOLDOWN_SECONDS
+            return
+        if len(self.outcomes) >= CAPTCHA_MIN_SAMPLES and sum(self.outcomes) / len(self.outcomes) >= CAPTCHA_RATE_THRESHOLD:
+            self.trip()
+
+    def trip(self):
+        self.tripped = True
+        self.open_until = time.time() + self.cooldown
+        self.outcomes.clear()
+        self.logger.warning(f"Captcha rate too high, pausing eBay requests for {self.cooldown} seconds")
+
+class FetchGovernor:
+    def __init__(self, max_concurrency: int):
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.breaker = CircuitBreaker()
+
+    def get_bucket(self, url: str) -> TokenBucket:
+        host = urlsplit(url).hostname or ""
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(EBAY_REQUESTS_PER_SECOND, EBAY_BURST)
+            self.buckets[host] = bucket
+        return bucket
+
+    async def acquire(self, url: str):
+        if self.breaker.is_open():
+            raise CircuitOpenError(f"eBay requests paused until {int(self.breaker.open_until)}")
+        await self.get_bucket(url).acquire()
+        await self.limiter.acquire()
+
+    def release(self, outcome: str):
+        self.limiter.release(outcome)
+        if outcome in (OK, CAPTCHA):
+            self.breaker.record(outcome == CAPTCHA)
@@ -0,0 +1,44 @@
+import re
+from typing import List, Optional
+
+OPENING_TAG = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)\b[^>]*>")
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+def find_element(html: str, class_name: str) -> Optional[str]:
+    """Raw HTML of the first element carrying class_name, matched on the class attribute
+    and closed by counting same-name tags. None if the class isn't found on an element."""
+    position = html.find(class_name)
+    while position != -1:
+        tag_start = html.rfind("<", 0, position)
+        opening = OPENING_TAG.match(html, tag_start) if tag_start != -1 else None
+        # The occurrence has to sit inside the opening tag's class attribute, not in a script or text
+        if opening and opening.end() > position and re.search(r'class="[^"]*$', html[tag_start:position]):
+            tag = opening.group(1).lower()
+            if tag in VOID_TAGS:
+                return opening.group(0)
+            end = find_closing_tag(html, tag, opening.end())
+            if end is not None:
+                return html[tag_start:end]
+        position = html.find(class_name, position + len(class_name))
+    return None
+
+def find_closing_tag(html: str, tag: str, start: int) -> Optional[int]:
+    depth = 1
+    for match in re.compile(rf"<(/?){tag}\b[^>]*?(/?)>", re.IGNORECASE).finditer(html, start):
+        if match.group(1):
+            depth -= 1
+        elif not match.group(2):
+            depth += 1
+        if depth == 0:
+            return match.end()
+    return None
+
+def extract_fragments(html: str, class_names: List[str]) -> Optional[str]:
+    """Minimal document holding only the elements for class_names, None if any of them is missing"""
+    fragments = []
+    for class_name in class_names:
+        fragment = find_element(html, class_name)
+        if fragment is None:
+            return None
+        fragments.append(fragment)
+    return "<html><body>" + "".join(fragments) + "</body></html>"
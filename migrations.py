@@ -0,0 +1,233 @@
+import logging
+from typing import List, NamedTuple
+from data import execute_query, get_db_connection, select_one
+from ebay_urls import canonicalize_url, get_item_id
+
+logger = logging.getLogger(__name__)
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: List[str]
+
+# Ordered schema changes applied on top of the base tables from init_db.
+# Never edit an applied migration, append a new one with the next version instead.
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Indexes on hot lookup columns", [
+        # INSERT OR IGNORE never ignored anything before this, drop duplicated relations first
+        """
+        DELETE FROM listing_relations WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM listing_relations GROUP BY user_id, listing_id
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_listing_relations_user_listing ON listing_relations (user_id, listing_id)",
+        "CREATE INDEX IF NOT EXISTS idx_listing_relations_listing ON listing_relations (listing_id)",
+        "CREATE INDEX IF NOT EXISTS idx_price_history_listing_date ON price_history (listing_id, date, price, currency)",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_target_type ON reminders (target_product_id, type)",
+        "CREATE INDEX IF NOT EXISTS idx_listings_url ON listings (url)",
+        "CREATE INDEX IF NOT EXISTS idx_settings_user ON settings (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)",
+    ]),
+    Migration(2, "Materialized latest price per listing", [
+        """
+        CREATE TABLE IF NOT EXISTS listing_latest (
+            listing_id TEXT PRIMARY KEY,
+            price REAL NOT NULL,
+            currency TEXT NOT NULL,
+            previous_price REAL,
+            last_price_change REAL NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP,
+            FOREIGN KEY (listing_id) REFERENCES listings (id)
+        )
+        """,
+        # Backfill: newest point per listing, and the newest differing price before it
+        """
+        INSERT OR REPLACE INTO listing_latest (listing_id, price, currency, previous_price, last_price_change, updated_at)
+        SELECT latest.listing_id, latest.price, latest.currency,
+            (SELECT ph.price FROM price_history ph
+             WHERE ph.listing_id = latest.listing_id AND ph.price != latest.price AND ph.date < latest.date
+             ORDER BY ph.date DESC LIMIT 1),
+            0, latest.date
+        FROM (
+            SELECT listing_id, price, currency, date, ROW_NUMBER() OVER (PARTITION BY listing_id ORDER BY date DESC) AS rn
+            FROM price_history
+        ) latest
+        WHERE latest.rn = 1
+        """,
+        "UPDATE listing_latest SET last_price_change = price - previous_price WHERE previous_price IS NOT NULL",
+    ]),
+    Migration(3, "Change-only price history with last observed timestamp", [
+        "ALTER TABLE price_history ADD COLUMN stock INTEGER",
+        "ALTER TABLE price_history ADD COLUMN last_seen TIMESTAMP",
+        "UPDATE price_history SET last_seen = date",
+    ]),
+    Migration(4, "Time of the last price change per listing", [
+        "ALTER TABLE listing_latest ADD COLUMN changed_at TIMESTAMP",
+        # Backfill: newest price point whose price differs from the one before it
+        """
+        UPDATE listing_latest SET changed_at = changes.changed_at
+        FROM (
+            SELECT listing_id, MAX(date) AS changed_at FROM (
+                SELECT listing_id, date, price, LAG(price) OVER (PARTITION BY listing_id ORDER BY date) AS previous_price
+                FROM price_history
+            )
+            WHERE previous_price IS NULL OR previous_price != price
+            GROUP BY listing_id
+        ) AS changes
+        WHERE changes.listing_id = listing_latest.listing_id
+        """,
+        "UPDATE listing_latest SET changed_at = updated_at WHERE changed_at IS NULL",
+    ]),
+    # SQLite can't change a CHECK constraint in place, so the table is rebuilt
+    Migration(5, "Threshold reminder rules", [
+        """
+        CREATE TABLE reminders_new (
+            id TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(4))) || '-' || lower(hex(randomblob(2))) || '-4' || substr(lower(hex(randomblob(2))),2) || '-' || substr('89ab',abs(random()) % 4 + 1, 1) || substr(lower(hex(randomblob(2))),2) || '-' || lower(hex(randomblob(6)))),
+            method TEXT NOT NULL CHECK (method IN ('telegram', 'sms', 'email')),
+            target_product_id TEXT NOT NULL,
+            type TEXT NOT NULL CHECK (type IN ('out_of_stock', 'back_in_stock', 'price_drop', 'price_increase', 'price_below', 'price_drop_percent')),
+            threshold REAL,
+            FOREIGN KEY (target_product_id) REFERENCES listings (id)
+        )
+        """,
+        "INSERT INTO reminders_new (id, method, target_product_id, type) SELECT id, method, target_product_id, type FROM reminders",
+        "DROP TABLE reminders",
+        "ALTER TABLE reminders_new RENAME TO reminders",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_target_type ON reminders (target_product_id, type)",
+    ]),
+    Migration(6, "Notification outbox", [
+        """
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            channel TEXT NOT NULL,
+            recipient TEXT,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_notification_outbox_due ON notification_outbox (status, next_attempt_at)",
+    ]),
+    Migration(7, "Reminders owned by users", [
+        "ALTER TABLE reminders ADD COLUMN user_id TEXT REFERENCES users (id)",
+        # Reminders were global until now, on a single user install they clearly belong to that user.
+        # Otherwise they stay unowned and keep going to the channel's default recipient.
+        "UPDATE reminders SET user_id = (SELECT id FROM users) WHERE (SELECT COUNT(*) FROM users) = 1",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_user ON reminders (user_id)",
+    ]),
+    # Ids used to be the last URL segment, query string included. They're the bare item id now,
+    # so old rows are moved over to it and merged with any row a refresh already created there.
+    Migration(8, "Listing ids from the eBay item id", [
+        """
+        CREATE TEMP TABLE listing_id_map AS
+        SELECT id AS old_id, ebay_item_id(url) AS new_id FROM listings
+        WHERE ebay_item_id(url) IS NOT NULL AND ebay_item_id(url) != id
+        """,
+        # Every id that ends up as new_id, including new_id itself
+        """
+        CREATE TEMP TABLE listing_id_group AS
+        SELECT old_id AS listing_id, new_id FROM listing_id_map
+        UNION SELECT new_id, new_id FROM listing_id_map
+        """,
+        """
+        CREATE TEMP TABLE listing_first_seen AS
+        SELECT g.new_id, MIN(l.created_at) AS created_at FROM listing_id_group g JOIN listings l ON l.id = g.listing_id GROUP BY g.new_id
+        """,
+        "UPDATE OR IGNORE listing_relations SET listing_id = (SELECT new_id FROM listing_id_map WHERE old_id = listing_id) WHERE listing_id IN (SELECT old_id FROM listing_id_map)",
+        # Relations left behind already existed under the new id
+        "DELETE FROM listing_relations WHERE listing_id IN (SELECT old_id FROM listing_id_map)",
+        "UPDATE price_history SET listing_id = (SELECT new_id FROM listing_id_map WHERE old_id = listing_id) WHERE listing_id IN (SELECT old_id FROM listing_id_map)",
+        # The most recently updated latest row of each group wins
+        """
+        DELETE FROM listing_latest WHERE rowid IN (
+            SELECT l.rowid FROM listing_latest l JOIN listing_id_group g ON g.listing_id = l.listing_id
+            WHERE EXISTS (
+                SELECT 1 FROM listing_latest o JOIN listing_id_group og ON og.listing_id = o.listing_id
+                WHERE og.new_id = g.new_id
+                AND (COALESCE(o.updated_at, '') > COALESCE(l.updated_at, '')
+                     OR (COALESCE(o.updated_at, '') = COALESCE(l.updated_at, '') AND o.rowid > l.rowid))
+            )
+        )
+        """,
+        "UPDATE listing_latest SET listing_id = (SELECT new_id FROM listing_id_map WHERE old_id = listing_id) WHERE listing_id IN (SELECT old_id FROM listing_id_map)",
+        "UPDATE reminders SET target_product_id = (SELECT new_id FROM listing_id_map WHERE old_id = target_product_id) WHERE target_product_id IN (SELECT old_id FROM listing_id_map)",
+        """
+        DELETE FROM reminders WHERE target_product_id IN (SELECT new_id FROM listing_id_map) AND rowid NOT IN (
+            SELECT MIN(rowid) FROM reminders GROUP BY user_id, method, target_product_id, type, threshold
+        )
+        """,
+        # A row already under the new id was written by a refresh and is the freshest, otherwise the newest old row is kept
+        "DELETE FROM listings WHERE id IN (SELECT old_id FROM listing_id_map WHERE new_id IN (SELECT id FROM listings))",
+        """
+        DELETE FROM listings WHERE id IN (
+            SELECT m.old_id FROM listing_id_map m JOIN listings l ON l.id = m.old_id
+            WHERE l.rowid < (SELECT MAX(l2.rowid) FROM listing_id_map m2 JOIN listings l2 ON l2.id = m2.old_id WHERE m2.new_id = m.new_id)
+        )
+        """,
+        "UPDATE listings SET id = (SELECT new_id FROM listing_id_map WHERE old_id = id) WHERE id IN (SELECT old_id FROM listing_id_map)",
+        "UPDATE listings SET created_at = (SELECT created_at FROM listing_first_seen WHERE new_id = id) WHERE id IN (SELECT new_id FROM listing_first_seen)",
+        "UPDATE listings SET url = ebay_canonical_url(url)",
+        "DROP TABLE listing_id_map",
+        "DROP TABLE listing_id_group",
+        "DROP TABLE listing_first_seen",
+    ]),
+    # Reminders left unowned by migration 7 could be neither listed nor deleted by anyone. Each one goes
+    # to every user tracking its listing, ones for listings nobody tracks are dropped.
+    Migration(9, "Give unowned reminders to the users tracking their listing", [
+        """
+        INSERT INTO reminders (method, target_product_id, type, threshold, user_id)
+        SELECT DISTINCT r.method, r.target_product_id, r.type, r.threshold, lr.user_id
+        FROM reminders r JOIN listing_relations lr ON lr.listing_id = r.target_product_id
+        WHERE r.user_id IS NULL AND NOT EXISTS (
+            SELECT 1 FROM reminders o
+            WHERE o.user_id = lr.user_id AND o.method = r.method AND o.target_product_id = r.target_product_id
+            AND o.type = r.type AND o.threshold IS r.threshold
+        )
+        """,
+        "DELETE FROM reminders WHERE user_id IS NULL",
+    ]),
+    # changed_at means the price changed, a listing's first price isn't a change
+    Migration(10, "No price change time for listings whose price never changed", [
+        "UPDATE listing_latest SET changed_at = NULL WHERE previous_price IS NULL",
+    ]),
+]
+
+async def get_schema_version() -> int:
+    row = await select_one("SELECT MAX(version) FROM schema_version")
+    return row[0] if row and row[0] is not None else 0
+
+async def run_migrations(migrations: List[Migration] = MIGRATIONS) -> int:
+    """Apply every migration newer than the stored schema version, each in its own transaction"""
+    await execute_query("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    current_version = await get_schema_version()
+    for migration in sorted(migrations, key=lambda m: m.version):
+        if migration.version <= current_version:
+            continue
+        async with get_db_connection() as conn:
+            try:
+                # URL helpers the statements can call
+                await conn.create_function("ebay_item_id", 1, get_item_id, deterministic=True)
+                await conn.create_function("ebay_canonical_url", 1, canonicalize_url, deterministic=True)
+                await conn.execute("BEGIN")
+                for statement in migration.statements:
+                    await conn.execute(statement)
+                await conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (migration.version, migration.description))
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                logger.error(f"Migration {migration.version} failed: {migration.description}")
+                raise
+        logger.info(f"Applied migration {migration.version}: {migration.description}")
+        current_version = migration.version
+    return current_version
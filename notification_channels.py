@@ -0,0 +1,129 @@
+import asyncio
+import os
+import smtplib
+from email.message import EmailMessage
+from typing import Dict, Optional
+import httpx
+from fetch_governor import TokenBucket
+from telegram_bot import BOT_TOKEN, RECIPENT_ID
+
+# Bot API base, pointed at a local fake in tests
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL") or "https://api.telegram.org"
+# Telegram allows about one message per second to the same chat and about 30 per second for the whole bot
+TELEGRAM_MESSAGES_PER_SECOND = float(os.getenv("TELEGRAM_MESSAGES_PER_SECOND") or 1)
+TELEGRAM_BOT_MESSAGES_PER_SECOND = float(os.getenv("TELEGRAM_BOT_MESSAGES_PER_SECOND") or 30)
+SMTP_HOST = os.getenv("SMTP_HOST")
+SMTP_PORT = int(os.getenv("SMTP_PORT") or 587)
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_FROM = os.getenv("SMTP_FROM") or SMTP_USER
+SMTP_TO = os.getenv("SMTP_TO")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS") != "FALSE"
+EMAIL_MESSAGES_PER_SECOND = float(os.getenv("EMAIL_MESSAGES_PER_SECOND") or 1)
+
+class PermanentDeliveryError(Exception):
+    """Retrying won't help: channel not configured, recipient rejected"""
+    pass
+
+class NotificationChannel:
+    name = ""
+    # Longest message the channel accepts, digests are split to fit
+    max_length = 4096
+
+    def __init__(self, messages_per_second: float, burst: int = 1):
+        self.bucket = TokenBucket(messages_per_second, burst)
+
+    async def acquire(self, recipient: Optional[str]):
+        """Waits until one more message may go out to recipient"""
+        await self.bucket.acquire()
+
+    async def send(self, recipient: Optional[str], text: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class TelegramChannel(NotificationChannel):
+    name = "telegram"
+
+    def __init__(self, token: Optional[str] = BOT_TOKEN, api_url: str = TELEGRAM_API_URL, default_chat_id: Optional[str] = RECIPENT_ID):
+        super().__init__(TELEGRAM_BOT_MESSAGES_PER_SECOND)
+        self.token = token
+        self.api_url = api_url
+        self.default_chat_id = default_chat_id
+        self.client: Optional[httpx.AsyncClient] = None
+        # One lane per chat under the bot-wide bucket, a burst for many users isn't paced like one chat
+        self.chat_buckets: Dict[str, TokenBucket] = {}
+
+    async def acquire(self, recipient: Optional[str]):
+        chat_id = recipient or self.default_chat_id or ""
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(TELEGRAM_MESSAGES_PER_SECOND, 1)
+            self.chat_buckets[chat_id] = bucket
+        # The chat's own wait comes first, so it doesn't sit on a bot-wide token meanwhile
+        await bucket.acquire()
+        await self.bucket.acquire()
+
+    async def send(self, recipient: Optional[str], text: str):
+        chat_id = recipient or self.default_chat_id
+        if not self.token or not chat_id:
+            raise PermanentDeliveryError("Telegram bot token or chat id not configured")
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=10)
+        response = await self.client.post(f"{self.api_url}/bot{self.token}/sendMessage", json={"chat_id": chat_id, "text": text})
+        if response.status_code in (400, 403):
+            raise PermanentDeliveryError(f"Telegram rejected the message: {response.text}")
+        response.raise_for_status()
+
+    async def close(self):
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+class EmailChannel(NotificationChannel):
+    name = "email"
+    max_length = 100000
+
+    def __init__(self, host: Optional[str] = SMTP_HOST, port: int = SMTP_PORT, default_recipient: Optional[str] = SMTP_TO):
+        super().__init__(EMAIL_MESSAGES_PER_SECOND)
+        self.host = host
+        self.port = port
+        self.default_recipient = default_recipient
+
+    async def send(self, recipient: Optional[str], text: str):
+        to = recipient or self.default_recipient
+        if not self.host or not to:
+            raise PermanentDeliveryError("SMTP host or recipient not configured")
+        message = EmailMessage()
+        message["Subject"] = text.splitlines()[0][:120]
+        message["From"] = SMTP_FROM or "pricechecker@localhost"
+        message["To"] = to
+        message.set_content(text)
+        # smtplib blocks, keep it off the event loop
+        await asyncio.to_thread(self.send_blocking, message)
+
+    def send_blocking(self, message: EmailMessage):
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.ehlo()
+            if SMTP_STARTTLS and smtp.has_extn("starttls"):
+                smtp.starttls()
+            if SMTP_USER:
+                smtp.login(SMTP_USER, SMTP_PASSWORD)
+            smtp.send_message(message)
+
+class LogChannel(NotificationChannel):
+    """No provider behind it yet, the message is only printed"""
+    def __init__(self, name: str):
+        super().__init__(100, 100)
+        self.name = name
+
+    async def send(self, recipient: Optional[str], text: str):
+        print(f"Sending {self.name} notification to {recipient}: {text}")
+
+def get_channels() -> Dict[str, NotificationChannel]:
+    return {
+        "telegram": TelegramChannel(),
+        "email": EmailChannel() if SMTP_HOST else LogChannel("email"),
+        "sms": LogChannel("sms"),
+    }
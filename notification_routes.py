@@ -0,0 +1,30 @@
+from typing import Dict, Iterable, Optional
+from classes import Settings
+
+# Settings field holding the user's address on each reminder method
+METHOD_FIELDS = {
+    "telegram": "telegram_userid",
+    "email": "email",
+    "sms": "phone_number",
+}
+
+class NotificationRoutes:
+    """In-memory user -> method -> recipient map built from the settings table. Loaded with the
+    reminders and kept current by the settings writes, so fan-out never reads settings per reminder."""
+    def __init__(self):
+        self.loaded = False
+        self.recipients: Dict[str, Dict[str, str]] = {}
+
+    def load(self, settings: Iterable[Settings]):
+        self.recipients = {}
+        for user_settings in settings:
+            self.update(user_settings)
+        self.loaded = True
+
+    def update(self, settings: Settings):
+        self.recipients[settings.user_id] = {method: getattr(settings, field) for method, field in METHOD_FIELDS.items() if getattr(settings, field)}
+
+    def recipient(self, user_id: str, method: str) -> Optional[str]:
+        return self.recipients.get(user_id, {}).get(method)
+
+notification_routes = NotificationRoutes()
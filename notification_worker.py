@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+from classes import SelectNotification
+from notification_channels import NotificationChannel, PermanentDeliveryError, get_channels
+from repository.outbox_repository import OutboxRepository
+
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS") or 5)
+OUTBOX_BATCH_SIZE = 500
+# This many pending notifications for one recipient on one channel go out as a single digest
+OUTBOX_DIGEST_THRESHOLD = int(os.getenv("OUTBOX_DIGEST_THRESHOLD") or 5)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS") or 8)
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS") or 10)
+OUTBOX_RETRY_MAX_SECONDS = 3600
+# Days sent notifications are kept, failed ones stay longer so they can be looked into
+OUTBOX_SENT_RETENTION_DAYS = float(os.getenv("OUTBOX_SENT_RETENTION_DAYS") or 7)
+OUTBOX_FAILED_RETENTION_DAYS = float(os.getenv("OUTBOX_FAILED_RETENTION_DAYS") or 30)
+OUTBOX_SWEEP_INTERVAL_SECONDS = 3600
+
+def split_message(text: str, max_length: int) -> List[str]:
+    """Split on paragraph breaks so every part fits the channel"""
+    parts = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > max_length:
+            parts.append(paragraph[:max_length])
+            paragraph = paragraph[max_length:]
+        candidate = f"{current}\n\n{paragraph}" if current else paragraph
+        if len(candidate) > max_length:
+            if current:
+                parts.append(current)
+            current = paragraph
+        else:
+            current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
+class NotificationWorker:
+    """Delivers the outbox, separately from the refresh loop so slow channels never hold up refreshes.
+    Delivery is at least once: a notification is marked sent after the channel accepted it."""
+    def __init__(self, channels: Optional[Dict[str, NotificationChannel]] = None):
+        self.channels = channels if channels is not None else get_channels()
+        self.outbox_repository = OutboxRepository()
+        self.wakeup = asyncio.Event()
+        self.next_sweep = 0
+        self.logger = logging.getLogger(__name__)
+
+    def notify(self):
+        """New notifications were queued"""
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                if time.time() >= self.next_sweep:
+                    await self.sweep()
+                await self.deliver_due()
+                await self.wait_for_next_due()
+            except Exception as e:
+                self.logger.error(f"Error in notification worker: {str(e)}")
+                await asyncio.sleep(OUTBOX_POLL_SECONDS)
+
+    async def sweep(self):
+        """Keep the outbox bounded, every notification would otherwise stay a row forever"""
+        self.next_sweep = time.time() + OUTBOX_SWEEP_INTERVAL_SECONDS
+        deleted = await self.outbox_repository.delete_finished(OUTBOX_SENT_RETENTION_DAYS, OUTBOX_FAILED_RETENTION_DAYS)
+        if deleted:
+            self.logger.info(f"Deleted {deleted} old notifications from the outbox")
+
+    async def wait_for_next_due(self):
+        now = time.time()
+        next_attempt_at = await self.outbox_repository.get_next_attempt_at()
+        wake_at = min(next_attempt_at or now + OUTBOX_POLL_SECONDS, now + OUTBOX_POLL_SECONDS)
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout=max(0, wake_at - now))
+        except asyncio.TimeoutError:
+            pass
+
+    async def deliver_due(self):
+        due = await self.outbox_repository.get_due(time.time(), OUTBOX_BATCH_SIZE)
+        groups = defaultdict(list)
+        for notification in due:
+            groups[(notification.channel, notification.recipient)].append(notification)
+        # Channels are rate limited independently, one slow channel doesn't delay the others
+        await asyncio.gather(*[self.deliver_channel(channel, [group for key, group in groups.items() if key[0] == channel])
+                               for channel in {channel for channel, _ in groups}])
+
+    async def deliver_channel(self, channel_name: str, groups: List[List[SelectNotification]]):
+        channel = self.channels.get(channel_name)
+        if channel is None:
+            for group in groups:
+                await self.outbox_repository.mark_failed([x.id for x in group], f"Unknown channel {channel_name}")
+            return
+        # Every group is one recipient, they go out side by side and the channel paces them
+        await asyncio.gather(*[self.deliver_group(channel, group) for group in groups])
+
+    async def deliver_group(self, channel: NotificationChannel, group: List[SelectNotification]):
+        if len(group) >= OUTBOX_DIGEST_THRESHOLD:
+            digest = f"🔔 {len(group)} listing updates\n\n" + "\n\n".join(x.message for x in group)
+            await self.deliver(channel, group, digest)
+        else:
+            for notification in group:
+                await self.deliver(channel, [notification], notification.message)
+
+    async def deliver(self, channel: NotificationChannel, notifications: List[SelectNotification], text: str):
+        ids = [x.id for x in notifications]
+        try:
+            for part in split_message(text, channel.max_length):
+                await channel.acquire(notifications[0].recipient)
+                await channel.send(notifications[0].recipient, part)
+        except PermanentDeliveryError as e:
+            self.logger.error(f"Notification {ids} failed: {str(e)}")
+            await self.outbox_repository.mark_failed(ids, str(e))
+            return
+        except Exception as e:
+            attempts = max(x.attempts for x in notifications) + 1
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                self.logger.error(f"Notification {ids} failed after {attempts} attempts: {str(e)}")
+                await self.outbox_repository.mark_failed(ids, str(e))
+            else:
+                delay = min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS)
+                await self.outbox_repository.mark_retry(ids, time.time() + delay * random.uniform(0.8, 1.2), str(e))
+            return
+        await self.outbox_repository.mark_sent(ids)
+
+    async def close(self):
+        for channel in self.channels.values():
+            await channel.close()
+
+notification_worker = NotificationWorker()
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+from types import SimpleNamespace
+from classes import SelectListing, SelectPriceHistory
+from debug_snapshots import snapshot_buffer
+from errors import CaptchaError
+from parser import ListingParser
+
+# Worker processes for HTML parsing, 0 parses inline on the event loop
+PARSER_WORKERS = int(os.getenv("PARSER_WORKERS") or os.cpu_count() or 1)
+
+# (id, title, url, stock, price, currency, date), price fields are None when the page has no price
+ParsedListing = Tuple[str, str, str, int, Optional[float], Optional[str], Optional[str]]
+
+worker_parser: Optional[ListingParser] = None
+
+def init_worker():
+    global worker_parser
+    # Snapshots recorded in a worker would land in that process' own buffer, ParsePool records them instead
+    worker_parser = ListingParser(snapshots=None)
+
+def parse_listing_page(url: str, content: bytes) -> ParsedListing:
+    """Runs inside a worker: raw page bytes in, compact tuple out, so little has to be pickled"""
+    if worker_parser is None:
+        init_worker()
+    response = SimpleNamespace(url=url, text=content.decode("utf-8", errors="replace"))
+    listing = worker_parser.parse_listing(response)
+    if listing.price_history:
+        price_history = listing.price_history[0]
+        return (listing.id, listing.title, listing.url, listing.stock, price_history.price, price_history.currency, price_history.date)
+    return (listing.id, listing.title, listing.url, listing.stock, None, None, None)
+
+def to_select_listing(parsed: ParsedListing) -> SelectListing:
+    id, title, url, stock, price, currency, date = parsed
+    price_history = [SelectPriceHistory(price=price, currency=currency, date=date)] if price is not None else []
+    return SelectListing(id=id, title=title, url=url, stock=stock, price_history=price_history)
+
+class ParsePool:
+    def __init__(self, workers: int = PARSER_WORKERS):
+        self.workers = workers
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.logger = logging.getLogger(__name__)
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            # spawn, forking the server would copy its event loop and database threads into every worker
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker)
+        return self.executor
+
+    async def run_parse(self, url: str, content: bytes) -> ParsedListing:
+        if self.workers <= 0:
+            return parse_listing_page(url, content)
+        executor = self.get_executor()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, parse_listing_page, url, content)
+        except BrokenProcessPool:
+            # A worker died (OOM, a crash in lxml) and took the pool with it, start over on a fresh one.
+            # Every parse in flight fails at once, only the first to get here replaces the pool.
+            if self.executor is executor:
+                self.logger.error("Parse pool broken, restarting it")
+                self.close()
+            return await asyncio.get_running_loop().run_in_executor(self.get_executor(), parse_listing_page, url, content)
+
+    async def parse_listing(self, url: str, content: bytes) -> SelectListing:
+        try:
+            parsed = await self.run_parse(url, content)
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            snapshot_buffer.record(url, "captcha" if isinstance(e, CaptchaError) else "exception", content.decode("utf-8", errors="replace"))
+            raise
+        if parsed[4] is None:
+            snapshot_buffer.record(url, "missing_price", content.decode("utf-8", errors="replace"))
+        return to_select_listing(parsed)
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -1,89 +1,115 @@
 from classes import ScrapedListing, SelectListing, SelectPriceHistory
-from bs4 import BeautifulSoup
+from debug_snapshots import SnapshotBuffer, snapshot_buffer
+from ebay_urls import get_item_id
+from errors import CaptchaError
+from html_fragments import extract_fragments
+from parser_engines import BeautifulSoupEngine, ParserEngine, get_engine
+from typing import Any, Optional
+import logging
+import os
 import requests
 from datetime import datetime
 
+CAPTCHA_MARKER = "Pardon Our Interruption..."
+
+# Routine refreshes only parse the buy box fragments, falling back to the full page when one is missing
+PARSER_FAST_REFRESH = os.getenv("PARSER_FAST_REFRESH") != "FALSE"
+FAST_REFRESH_CLASSES = ["x-item-title__mainTitle", "x-bin-price__content", "x-quantity__availability"]
+
 class ListingParser:
+    def __init__(self, engine: Optional[ParserEngine] = None, fast_refresh: bool = PARSER_FAST_REFRESH, snapshots: Optional[SnapshotBuffer] = snapshot_buffer):
+        self.engine = engine or get_engine()
+        self.fast_refresh = fast_refresh
+        # None in parse pool workers, which leave recording failed pages to the parent process
+        self.snapshots = snapshots
+        self.fallback_engine = BeautifulSoupEngine()
+        self.logger = logging.getLogger(__name__)
 
     def parse_id_from_url(self, url: str) -> str:
+        item_id = get_item_id(url)
+        if item_id:
+            return item_id
         splitted = url.split("/")
         if len(splitted) > 3:
             return splitted[-1]
         else:
             #seems invalid url
             return None
-        
-    def parse_title(self, bs: BeautifulSoup) -> str:
-        return bs.select_one(".x-item-title__mainTitle").text.strip()
-    
+
+    def parse_title(self, engine: ParserEngine, doc: Any) -> str:
+        title = engine.title(doc)
+        if title is None:
+            raise ValueError("Title not found")
+        return title
+
     def parse_listing_details(self, response: requests.Response, download_images: bool):
-        basic_details = self.parse_listing(response)
-        bs = BeautifulSoup(response.text, "html.parser")
-        dl_elements = bs.find_all('dl', class_='ux-labels-values')
-        features = {}
-        for dl in dl_elements:
-            key = dl.find('dt', class_='ux-labels-values__labels').get_text(strip=True)
-            value = dl.find('dd', class_='ux-labels-values__values').get_text(strip=True)
-            features[key] = value
+        return self.parse_with_fallback(response, lambda engine, doc: self.extract_listing_details(engine, doc, response, download_images))
 
-        seller_url = ""
-        seller_elem = bs.find("div", class_="x-sellercard-atf__info__about-seller")
-        if seller_elem:
-            seller_link = seller_elem.find("a")
-            if seller_link: 
-                seller_url = seller_link.attrs.get("href")
+    def extract_listing_details(self, engine: ParserEngine, doc: Any, response: requests.Response, download_images: bool) -> ScrapedListing:
+        basic_details = self.extract_listing(engine, doc, response)
         image_urls = []
         if download_images:
-            image_cotainer = bs.find('div', class_="ux-image-grid no-scrollbar")
-            img_elements = image_cotainer.find_all('img')
-
-            image_urls = [str(img['src']).replace("l140", "l1600") for img in img_elements if 'src' in img.attrs]
-            data_image_urls = [str(img['data-src']).replace("l140", "l1600") for img in img_elements if 'data-src' in img.attrs]
-            image_urls.extend(data_image_urls)
+            src_urls, data_src_urls = engine.image_urls(doc)
+            image_urls = [url.replace("l140", "l1600") for url in src_urls + data_src_urls]
 
         return ScrapedListing(
-                              id=basic_details.id, 
-                              title=basic_details.title, 
-                              url=response.url, 
+                              id=basic_details.id,
+                              title=basic_details.title,
+                              url=response.url,
                               stock=basic_details.stock,
                               price=basic_details.price_history[-1].price,
-                              features=features,
+                              features=engine.features(doc),
                               images=image_urls,
                               scraped_at=datetime.now(),
-                              seller_url=seller_url)
+                              seller_url=engine.seller_url(doc))
 
     def parse_listing(self, response: requests.Response) -> SelectListing:
-        bs = BeautifulSoup(response.text, "html.parser")
-        if "Pardon Our Interruption..." in bs.text:
-            raise Exception("Captcha detected")
-        file = open("bs.html", "w", encoding="utf-8")
-        file.write(bs.prettify())
-        file.close()
-        price_element = bs.select_one(".x-bin-price__content .x-price-primary .ux-textspans")
+        listing = self.parse_with_fallback(response, lambda engine, doc: self.extract_listing(engine, doc, response), self.fast_refresh)
+        if not listing.price_history and self.snapshots:
+            self.snapshots.record(response.url, "missing_price", response.text)
+        return listing
+
+    def parse_with_fallback(self, response: requests.Response, extract, use_fragments: bool = False):
+        """Parse the document once with the configured engine, retry with BeautifulSoup if that fails.
+        With use_fragments the buy box fragments are tried first and the full page only parsed if they miss."""
+        try:
+            if CAPTCHA_MARKER in response.text:
+                raise CaptchaError("Captcha detected")
+            if use_fragments:
+                fragment_html = extract_fragments(response.text, FAST_REFRESH_CLASSES)
+                if fragment_html:
+                    try:
+                        return extract(self.engine, self.engine.load(fragment_html))
+                    except Exception as e:
+                        self.logger.warning(f"Fast refresh parse failed for {response.url}, parsing full page: {str(e)}")
+            try:
+                return extract(self.engine, self.engine.load(response.text))
+            except Exception as e:
+                if self.engine.name == self.fallback_engine.name:
+                    raise
+                self.logger.warning(f"{self.engine.name} parser failed for {response.url}, falling back to {self.fallback_engine.name}: {str(e)}")
+                return extract(self.fallback_engine, self.fallback_engine.load(response.text))
+        except Exception as e:
+            if self.snapshots:
+                reason = "captcha" if isinstance(e, CaptchaError) else "exception"
+                self.snapshots.record(response.url, reason, response.text)
+            raise
+
+    def extract_listing(self, engine: ParserEngine, doc: Any, response: requests.Response) -> SelectListing:
+        price_text = engine.price_text(doc)
         price_history = []
-        if price_element:
-            price_text = price_element.text.strip()
+        if price_text:
             currency = price_text.split()[0]
-            price = float(price_text.split()[-1].replace('$', '').replace('/ea', '').replace(",", ".").replace("/db", "")) 
+            price = float(price_text.split()[-1].replace('$', '').replace('/ea', '').replace(",", ".").replace("/db", ""))
             price_history.append(SelectPriceHistory(price=price, date=datetime.now().isoformat(), currency=currency))
-        else:
-            currency = None
-            price = None
 
-        stock_element = bs.select_one(".x-quantity__availability")
+        availability = engine.availability(doc)
         stock = 0
-        found = False
-        if stock_element:
-            quantity_elements = stock_element.select("span")
-            for qe in quantity_elements:
-                if qe.text == "Out of Stock":
-                    found = True
-                    stock = 0
-                    break
-            if found == False:
-                quantity_element = stock_element.select_one(".ux-textspans.ux-textspans--SECONDARY") 
+        if availability:
+            span_texts, quantity_text = availability
+            if "Out of Stock" not in span_texts:
                 try:
-                    text = quantity_element.text.strip()
+                    text = quantity_text or ""
                     if text.startswith("More than"):
                         stock = int(text.split()[2])  # Get number after "More than"
                     else:
@@ -93,9 +119,8 @@ class ListingParser:
 
         return SelectListing(
             id=self.parse_id_from_url(response.url),
-            title=self.parse_title(bs),
+            title=self.parse_title(engine, doc),
             url=response.url,
             stock=stock,
             price_history=price_history
         )
-
@@ -0,0 +1,163 @@
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# "lxml" (C-backed, default) or "bs4" (pure python html.parser)
+PARSER_ENGINE = os.getenv("PARSER_ENGINE") or "lxml"
+
+logger = logging.getLogger(__name__)
+
+class ParserEngine:
+    """Extracts the raw strings of an eBay item page from a single parsed tree.
+    Converting them into prices, stock counts and models is left to ListingParser,
+    so every engine returns identical results for the same page."""
+    name = ""
+
+    def load(self, html: str) -> Any:
+        raise NotImplementedError
+
+    def title(self, doc: Any) -> Optional[str]:
+        raise NotImplementedError
+
+    def price_text(self, doc: Any) -> Optional[str]:
+        raise NotImplementedError
+
+    def availability(self, doc: Any) -> Optional[Tuple[List[str], Optional[str]]]:
+        """Texts of every span in the availability block and of its secondary quantity span,
+        None when the page has no availability block"""
+        raise NotImplementedError
+
+    def features(self, doc: Any) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def seller_url(self, doc: Any) -> str:
+        raise NotImplementedError
+
+    def image_urls(self, doc: Any) -> Tuple[List[str], List[str]]:
+        """src and data-src attributes of the gallery images"""
+        raise NotImplementedError
+
+
+class BeautifulSoupEngine(ParserEngine):
+    name = "bs4"
+
+    def load(self, html: str) -> BeautifulSoup:
+        return BeautifulSoup(html, "html.parser")
+
+    def title(self, doc: BeautifulSoup) -> Optional[str]:
+        element = doc.select_one(".x-item-title__mainTitle")
+        return element.text.strip() if element else None
+
+    def price_text(self, doc: BeautifulSoup) -> Optional[str]:
+        element = doc.select_one(".x-bin-price__content .x-price-primary .ux-textspans")
+        return element.text.strip() if element else None
+
+    def availability(self, doc: BeautifulSoup) -> Optional[Tuple[List[str], Optional[str]]]:
+        stock_element = doc.select_one(".x-quantity__availability")
+        if not stock_element:
+            return None
+        quantity_element = stock_element.select_one(".ux-textspans.ux-textspans--SECONDARY")
+        return [qe.text for qe in stock_element.select("span")], quantity_element.text.strip() if quantity_element else None
+
+    def features(self, doc: BeautifulSoup) -> Dict[str, str]:
+        features = {}
+        for dl in doc.find_all('dl', class_='ux-labels-values'):
+            key = dl.find('dt', class_='ux-labels-values__labels')
+            value = dl.find('dd', class_='ux-labels-values__values')
+            if key and value:
+                features[key.get_text(strip=True)] = value.get_text(strip=True)
+        return features
+
+    def seller_url(self, doc: BeautifulSoup) -> str:
+        seller_elem = doc.find("div", class_="x-sellercard-atf__info__about-seller")
+        if seller_elem:
+            seller_link = seller_elem.find("a")
+            if seller_link:
+                return seller_link.attrs.get("href") or ""
+        return ""
+
+    def image_urls(self, doc: BeautifulSoup) -> Tuple[List[str], List[str]]:
+        image_container = doc.find('div', class_="ux-image-grid no-scrollbar")
+        if not image_container:
+            return [], []
+        img_elements = image_container.find_all('img')
+        return [str(img['src']) for img in img_elements if 'src' in img.attrs], [str(img['data-src']) for img in img_elements if 'data-src' in img.attrs]
+
+
+def has_class(*classes: str) -> str:
+    """XPath predicate matching elements carrying every given class token, like a CSS class selector"""
+    return " and ".join(f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')" for name in classes)
+
+
+class LxmlEngine(ParserEngine):
+    name = "lxml"
+
+    def __init__(self):
+        self.html_parser = lxml.html.HTMLParser(encoding="utf-8")
+
+    def load(self, html: str) -> Any:
+        return lxml.html.document_fromstring(html.encode("utf-8"), parser=self.html_parser)
+
+    def first(self, doc: Any, xpath: str) -> Any:
+        found = doc.xpath(xpath)
+        return found[0] if found else None
+
+    def text(self, element: Any, strip: bool = False) -> str:
+        if strip:
+            return "".join(part.strip() for part in element.itertext())
+        return "".join(element.itertext())
+
+    def title(self, doc: Any) -> Optional[str]:
+        element = self.first(doc, f"//*[{has_class('x-item-title__mainTitle')}]")
+        return self.text(element).strip() if element is not None else None
+
+    def price_text(self, doc: Any) -> Optional[str]:
+        element = self.first(doc, f"//*[{has_class('x-bin-price__content')}]//*[{has_class('x-price-primary')}]//*[{has_class('ux-textspans')}]")
+        return self.text(element).strip() if element is not None else None
+
+    def availability(self, doc: Any) -> Optional[Tuple[List[str], Optional[str]]]:
+        stock_element = self.first(doc, f"//*[{has_class('x-quantity__availability')}]")
+        if stock_element is None:
+            return None
+        quantity_element = self.first(stock_element, f".//*[{has_class('ux-textspans', 'ux-textspans--SECONDARY')}]")
+        return [self.text(qe) for qe in stock_element.xpath(".//span")], self.text(quantity_element).strip() if quantity_element is not None else None
+
+    def features(self, doc: Any) -> Dict[str, str]:
+        features = {}
+        for dl in doc.xpath(f"//dl[{has_class('ux-labels-values')}]"):
+            key = self.first(dl, f".//dt[{has_class('ux-labels-values__labels')}]")
+            value = self.first(dl, f".//dd[{has_class('ux-labels-values__values')}]")
+            if key is not None and value is not None:
+                features[self.text(key, strip=True)] = self.text(value, strip=True)
+        return features
+
+    def seller_url(self, doc: Any) -> str:
+        seller_elem = self.first(doc, f"//div[{has_class('x-sellercard-atf__info__about-seller')}]")
+        if seller_elem is not None:
+            seller_link = self.first(seller_elem, ".//a")
+            if seller_link is not None:
+                return seller_link.get("href") or ""
+        return ""
+
+    def image_urls(self, doc: Any) -> Tuple[List[str], List[str]]:
+        image_container = self.first(doc, "//div[@class='ux-image-grid no-scrollbar']")
+        if image_container is None:
+            return [], []
+        img_elements = image_container.xpath(".//img")
+        return [img.get("src") for img in img_elements if img.get("src") is not None], [img.get("data-src") for img in img_elements if img.get("data-src") is not None]
+
+
+def get_engine(name: str = PARSER_ENGINE) -> ParserEngine:
+    if name == "lxml":
+        if lxml is not None:
+            return LxmlEngine()
+        logger.warning("lxml is not installed, falling back to the BeautifulSoup parser engine")
+    elif name != "bs4":
+        logger.warning(f"Unknown parser engine {name}, falling back to the BeautifulSoup parser engine")
+    return BeautifulSoupEngine()
@@ -0,0 +1,81 @@
+import asyncio
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import bcrypt
+from errors import PasswordBusyError
+
+# bcrypt releases the GIL, so threads hash in parallel without blocking the event loop.
+# 0 hashes on the event loop like before, only useful for comparing in the load test.
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS") or min(4, os.cpu_count() or 1))
+# Password checks running or waiting for a worker before new ones are turned away,
+# a few hashes per worker keeps the wait for an accepted login around a second
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT") or max(PASSWORD_WORKERS, 1) * 4)
+# Concurrent checks allowed for one client address and one account
+PASSWORD_MAX_PER_IP = int(os.getenv("PASSWORD_MAX_PER_IP") or 4)
+PASSWORD_MAX_PER_EMAIL = int(os.getenv("PASSWORD_MAX_PER_EMAIL") or 2)
+
+class PasswordHasher:
+    """Runs bcrypt in a bounded pool. Past the queue limit or a client's cap requests fail fast
+    with PasswordBusyError, so a login burst costs latency for logins only."""
+    def __init__(self, workers: int = PASSWORD_WORKERS, queue_limit: int = PASSWORD_QUEUE_LIMIT,
+                 max_per_ip: int = PASSWORD_MAX_PER_IP, max_per_email: int = PASSWORD_MAX_PER_EMAIL):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="bcrypt") if workers > 0 else None
+        self.queue_limit = queue_limit
+        self.max_per_ip = max_per_ip
+        self.max_per_email = max_per_email
+        self.pending = 0
+        self.by_ip = Counter()
+        self.by_email = Counter()
+
+    def admit(self, ip: Optional[str], email: Optional[str]):
+        if self.pending >= self.queue_limit:
+            raise PasswordBusyError("Too many logins in progress")
+        if ip and self.by_ip[ip] >= self.max_per_ip:
+            raise PasswordBusyError(f"Too many logins from {ip}")
+        if email and self.by_email[email] >= self.max_per_email:
+            raise PasswordBusyError(f"Too many logins for {email}")
+        self.pending += 1
+        self.by_ip[ip] += 1
+        self.by_email[email] += 1
+
+    def release(self, ip: Optional[str], email: Optional[str]):
+        self.pending -= 1
+        self.by_ip[ip] -= 1
+        self.by_email[email] -= 1
+        if not self.by_ip[ip]:
+            del self.by_ip[ip]
+        if not self.by_email[email]:
+            del self.by_email[email]
+
+    async def run(self, function, *args, ip: Optional[str] = None, email: Optional[str] = None):
+        self.admit(ip, email)
+        if self.executor is None:
+            try:
+                return function(*args)
+            finally:
+                self.release(ip, email)
+        loop = asyncio.get_running_loop()
+        try:
+            future = self.executor.submit(function, *args)
+        except BaseException:
+            self.release(ip, email)
+            raise
+        # The slot is held until the work itself finishes or is cancelled, not until the caller stops waiting:
+        # a request that times out or disconnects leaves its hash running, and that still counts
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release, ip, email))
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str, ip: Optional[str] = None, email: Optional[str] = None) -> str:
+        hashed = await self.run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(), ip=ip, email=email)
+        return hashed.decode('utf-8')
+
+    async def verify(self, password: str, hashed: str, ip: Optional[str] = None, email: Optional[str] = None) -> bool:
+        return await self.run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'), ip=ip, email=email)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+password_hasher = PasswordHasher()
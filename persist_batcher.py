@@ -0,0 +1,57 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+# Parsed listings written per transaction, and how long a partial batch waits for more
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE") or 50)
+PERSIST_BATCH_DELAY = float(os.getenv("PERSIST_BATCH_DELAY") or 0.2)
+
+class PersistBatcher:
+    """Collects items from concurrent refreshes and hands them to write_batch together,
+    once the batch is full or the delay since its first item ran out"""
+    def __init__(self, write_batch: Callable[[List[Any]], Awaitable[Any]], size: int = PERSIST_BATCH_SIZE, delay: float = PERSIST_BATCH_DELAY):
+        self.write_batch = write_batch
+        self.size = size
+        self.delay = delay
+        self.pending: List[Tuple[Any, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.flush_tasks = set()
+
+    async def submit(self, item: Any):
+        """Wait until the batch containing item is committed, raises if writing it failed"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.size:
+            self.start_flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.delay, self.start_flush)
+        await future
+
+    def start_flush(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self.flush(batch))
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    async def flush(self, batch: List[Tuple[Any, asyncio.Future]]):
+        try:
+            await self.write_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def drain(self):
+        """Write whatever is still pending and wait for every flush in progress, on shutdown"""
+        self.start_flush()
+        if self.flush_tasks:
+            await asyncio.gather(*self.flush_tasks, return_exceptions=True)
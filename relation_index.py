@@ -0,0 +1,38 @@
+from collections import defaultdict
+from typing import Dict, Iterable, Set
+
+
+class RelationIndex:
+    """In-memory listing <-> user map of listing_relations. Reloaded with the schedule sync
+    and kept current in between by the add and delete paths."""
+    def __init__(self):
+        self.users_by_listing: Dict[str, Set[str]] = defaultdict(set)
+        self.listings_by_user: Dict[str, Set[str]] = defaultdict(set)
+
+    def load(self, relations: Iterable[dict]):
+        users_by_listing = defaultdict(set)
+        listings_by_user = defaultdict(set)
+        for relation in relations:
+            users_by_listing[relation['listing_id']].add(relation['user_id'])
+            listings_by_user[relation['user_id']].add(relation['listing_id'])
+        self.users_by_listing = users_by_listing
+        self.listings_by_user = listings_by_user
+
+    def add(self, user_id: str, listing_id: str):
+        self.users_by_listing[listing_id].add(user_id)
+        self.listings_by_user[user_id].add(listing_id)
+
+    def remove(self, user_id: str, listing_id: str):
+        self.users_by_listing.get(listing_id, set()).discard(user_id)
+        self.listings_by_user.get(user_id, set()).discard(listing_id)
+
+    def users_of(self, listing_ids: Iterable[str]) -> Set[str]:
+        users = set()
+        for listing_id in listing_ids:
+            users |= self.users_by_listing.get(listing_id, set())
+        return users
+
+    def listings_of(self, user_id: str) -> Set[str]:
+        return self.listings_by_user.get(user_id, set())
+
+relation_index = RelationIndex()
@@ -0,0 +1,114 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from classes import SelectListing, SelectReminder
+
+# Change events produced by the refresh pipeline, also the plain reminder types
+OUT_OF_STOCK = "out_of_stock"
+BACK_IN_STOCK = "back_in_stock"
+PRICE_DROP = "price_drop"
+PRICE_INCREASE = "price_increase"
+# Threshold rules: price falls below threshold, price drops by at least threshold percent in one change
+PRICE_BELOW = "price_below"
+PRICE_DROP_PERCENT = "price_drop_percent"
+
+# The event each reminder type is evaluated on
+RULE_EVENTS = {
+    OUT_OF_STOCK: OUT_OF_STOCK,
+    BACK_IN_STOCK: BACK_IN_STOCK,
+    PRICE_DROP: PRICE_DROP,
+    PRICE_INCREASE: PRICE_INCREASE,
+    PRICE_BELOW: PRICE_DROP,
+    PRICE_DROP_PERCENT: PRICE_DROP,
+}
+THRESHOLD_RULES = {PRICE_BELOW, PRICE_DROP_PERCENT}
+
+class ListingChange(NamedTuple):
+    listing_id: str
+    events: Tuple[str, ...]
+    old_price: Optional[float]
+    new_price: Optional[float]
+    currency: Optional[str]
+    # When the new state was observed, part of the notification idempotency keys
+    observed_at: str
+
+def detect_change(existing_listing: SelectListing, parsed_listing: SelectListing) -> Optional[ListingChange]:
+    """Stock transitions and price moves between the stored and the freshly parsed listing, None without any"""
+    events = []
+    if existing_listing.stock > 0 and parsed_listing.stock == 0:
+        events.append(OUT_OF_STOCK)
+    elif existing_listing.stock == 0 and parsed_listing.stock > 0:
+        events.append(BACK_IN_STOCK)
+    old = existing_listing.price_history[0] if existing_listing.price_history else None
+    new = parsed_listing.price_history[0] if parsed_listing.price_history else None
+    # A currency switch isn't a price move
+    if old and new and old.currency == new.currency:
+        if new.price < old.price:
+            events.append(PRICE_DROP)
+        elif new.price > old.price:
+            events.append(PRICE_INCREASE)
+    if not events:
+        return None
+    observed_at = new.date if new else datetime.now().isoformat()
+    return ListingChange(parsed_listing.id, tuple(events), old.price if old else None, new.price if new else None, new.currency if new else None, observed_at)
+
+def rule_matches(reminder: SelectReminder, change: ListingChange) -> bool:
+    if reminder.type == PRICE_BELOW:
+        return change.new_price < reminder.threshold <= change.old_price
+    if reminder.type == PRICE_DROP_PERCENT:
+        return change.old_price > 0 and (change.old_price - change.new_price) / change.old_price * 100 >= reminder.threshold
+    return True
+
+def validate_rule(type: str, threshold: Optional[float]) -> Optional[str]:
+    """Error message for an invalid reminder rule, None when it's fine"""
+    if type not in RULE_EVENTS:
+        return "Unknown reminder type"
+    if type in THRESHOLD_RULES and (threshold is None or threshold <= 0):
+        return "Threshold required"
+    if type == PRICE_DROP_PERCENT and threshold > 100:
+        return "Threshold must be a percentage"
+    return None
+
+class ReminderIndex:
+    """Reminders by listing id and the event they fire on. Loaded once, then kept current
+    by the add and delete paths, so a refresh only looks at the listings that changed."""
+    def __init__(self):
+        self.loaded = False
+        self.rules: Dict[str, Dict[str, Dict[str, SelectReminder]]] = defaultdict(lambda: defaultdict(dict))
+        self.by_id: Dict[str, SelectReminder] = {}
+
+    def load(self, reminders: Iterable[SelectReminder]):
+        self.rules.clear()
+        self.by_id.clear()
+        for reminder in reminders:
+            self.add(reminder)
+        self.loaded = True
+
+    def add(self, reminder: SelectReminder):
+        self.by_id[reminder.id] = reminder
+        self.rules[reminder.target_product_id][RULE_EVENTS[reminder.type]][reminder.id] = reminder
+
+    def remove(self, reminder_id: str):
+        reminder = self.by_id.pop(reminder_id, None)
+        if reminder is None:
+            return
+        listing_rules = self.rules.get(reminder.target_product_id)
+        if listing_rules:
+            listing_rules[RULE_EVENTS[reminder.type]].pop(reminder_id, None)
+            if not any(listing_rules.values()):
+                del self.rules[reminder.target_product_id]
+
+    def find(self, user_id: Optional[str], method: str, target_product_id: str, type: str, threshold: Optional[float]) -> Optional[SelectReminder]:
+        candidates = self.rules.get(target_product_id, {}).get(RULE_EVENTS[type], {}).values()
+        return next((x for x in candidates if (x.user_id, x.method, x.type, x.threshold) == (user_id, method, type, threshold)), None)
+
+    def listing_ids(self) -> Set[str]:
+        return set(self.rules)
+
+    def matching(self, change: ListingChange) -> List[SelectReminder]:
+        listing_rules = self.rules.get(change.listing_id)
+        if not listing_rules:
+            return []
+        return [reminder for event in change.events for reminder in listing_rules.get(event, {}).values() if rule_matches(reminder, change)]
+
+reminder_index = ReminderIndex()
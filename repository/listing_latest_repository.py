@@ -0,0 +1,35 @@
+from typing import Iterable, Optional, Tuple
+import aiosqlite
+from classes import InsertPriceHistory
+from data import execute_query, select_one
+
+# Column references in DO UPDATE see the row before the update.
+# changed_at stays NULL until the price first differs from the one seen before it.
+UPDATE_LATEST_QUERY = """
+    INSERT INTO listing_latest (listing_id, price, currency, previous_price, last_price_change, updated_at, changed_at)
+    VALUES (?1, ?2, ?3, NULL, 0, ?4, NULL)
+    ON CONFLICT(listing_id) DO UPDATE SET
+        previous_price = CASE WHEN listing_latest.price != excluded.price THEN listing_latest.price ELSE listing_latest.previous_price END,
+        last_price_change = CASE WHEN listing_latest.price != excluded.price THEN excluded.price - listing_latest.price ELSE listing_latest.last_price_change END,
+        changed_at = CASE WHEN listing_latest.price != excluded.price THEN excluded.updated_at ELSE listing_latest.changed_at END,
+        price = excluded.price,
+        currency = excluded.currency,
+        updated_at = excluded.updated_at
+"""
+
+class ListingLatestRepository:
+    """Current price and last price change per listing, kept up to date on every price write
+    so display queries don't have to replay the whole price history."""
+
+    async def get_latest(self, listing_id: str) -> Optional[dict]:
+        return await select_one("SELECT * FROM listing_latest WHERE listing_id = ?", (listing_id,), as_dict=True)
+
+    async def update_latest(self, listing_id: str, price_history: InsertPriceHistory):
+        return await execute_query(UPDATE_LATEST_QUERY, (listing_id, price_history.price, price_history.currency, price_history.date))
+
+    async def update_latest_many(self, conn: aiosqlite.Connection, prices: Iterable[Tuple[str, InsertPriceHistory]]):
+        """(listing_id, price) pairs in observation order, on a connection inside a transaction"""
+        await conn.executemany(UPDATE_LATEST_QUERY, [(listing_id, price_history.price, price_history.currency, price_history.date) for listing_id, price_history in prices])
+
+    async def delete_latest(self, listing_id: str):
+        return await execute_query("DELETE FROM listing_latest WHERE listing_id = ?", (listing_id,))
@@ -1,5 +1,7 @@
 
 import uuid
+from typing import Iterable, Tuple
+import aiosqlite
 from data import execute_query, select_all_dict
 
 
@@ -20,5 +22,10 @@ class ListingRelationsRepository:
         generated_uuid = str(uuid.uuid4())
         return await execute_query("INSERT OR IGNORE INTO listing_relations (id, user_id, listing_id) VALUES (?, ?, ?)", (generated_uuid, user_id, listing_id))
     
+    async def insert_listing_relations(self, conn: aiosqlite.Connection, relations: Iterable[Tuple[str, str]]):
+        """(user_id, listing_id) pairs, on a connection inside a transaction"""
+        await conn.executemany("INSERT OR IGNORE INTO listing_relations (id, user_id, listing_id) VALUES (?, ?, ?)",
+                               [(str(uuid.uuid4()), user_id, listing_id) for user_id, listing_id in relations])
+
     async def delete_listing_relation(self, listing_id, user_id):
         return await execute_query("DELETE FROM listing_relations WHERE user_id = ? AND listing_id = ?", (user_id, listing_id))
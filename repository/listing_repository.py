@@ -1,49 +1,96 @@
+import base64
+import binascii
+import json
 import time
-from data import select_all, execute_query, select_one
-from classes import DisplayListing, SelectListing, InsertListing, SelectPriceHistory
-from typing import List, Optional
+from data import select_all, execute_query, execute_update, select_one
+from classes import DisplayListing, ListingQuery, SelectListing, InsertListing, SelectPriceHistory
+from typing import Any, List, Optional, Tuple
+import aiosqlite
 
 from repository.listing_relations_repository import ListingRelationsRepository
+from repository.listing_latest_repository import ListingLatestRepository
 from repository.price_history_repository import PriceHistoryRepository
 
+UPSERT_LISTING_QUERY = """
+    INSERT INTO listings (id, title, url, stock) 
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        title = excluded.title,
+        url = excluded.url,
+        stock = excluded.stock
+"""
+
+# Columns a user's listing page can be sorted by, the listing id breaks ties for the keyset cursor
+LISTING_SORT_COLUMNS = {
+    "created_at": "l.created_at",
+    "price": "COALESCE(ll.price, 0)",
+    "last_price_change": "COALESCE(ll.last_price_change, 0)",
+}
+# Fields a listing page can return, DisplayListing's by default
+LISTING_FIELD_COLUMNS = {
+    "id": "l.id",
+    "title": "l.title",
+    "url": "l.url",
+    "stock": "l.stock",
+    "price": "COALESCE(ll.price, 0)",
+    "last_price_change": "COALESCE(ll.last_price_change, 0)",
+    "changed_at": "ll.changed_at",
+    "created_at": "l.created_at",
+}
+DISPLAY_FIELDS = ["id", "title", "stock", "url", "price", "last_price_change"]
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(sort_value: Any, listing_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort_value, listing_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        sort_value, listing_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return sort_value, str(listing_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError("Invalid cursor")
+
 class ListingRepository:
     def __init__(self):
         self.listings = []
         self.listing_relation_repo = ListingRelationsRepository()
 
+    async def get_refresh_targets(self) -> List[tuple]:
+        """(id, url, interval) per listing, interval being the smallest one among the users tracking it"""
+        return await select_all("""
+            SELECT l.id, l.url, MIN(s.interval) AS interval
+            FROM listings l
+            LEFT JOIN listing_relations lr ON lr.listing_id = l.id
+            LEFT JOIN settings s ON s.user_id = lr.user_id
+            GROUP BY l.id
+        """)
+
     async def get_listing_count(self, id: str) -> int:
         return await execute_query("SELECT COUNT(*) FROM listings WHERE id = ?", (id,))
 
     async def get_all_listings_display(self) -> List[DisplayListing]:
-        """Get all listings suitable for frontend display. More efficent processing."""
+        """Get all listings suitable for frontend display. Reads the materialized latest price, one row per listing."""
         start_time = time.time()
         listings = await select_all("""
-            SELECT l.*, ph.price, ph.date, ph.currency 
+            SELECT l.id, l.title, l.url, l.stock, ll.price, ll.last_price_change
             FROM listings l
-            LEFT JOIN price_history ph ON l.id = ph.listing_id
-            ORDER BY ph.date ASC
+            LEFT JOIN listing_latest ll ON l.id = ll.listing_id
         """, as_dict=True)
 
-        listing_map = {}
-        for row in listings:
-            existing_listing = listing_map.get(row['id'], None) 
-            price_change = 0
-            if existing_listing and existing_listing.price != row['price']:
-                #found price change
-                price_change = row['price'] - existing_listing.price
-            if price_change != 0 or existing_listing is None:
-                listing_map[row['id']] = DisplayListing(
-                    id=row['id'],
-                    title=row['title'], 
-                    url=row['url'],
-                    stock=row['stock'],
-                    price=row['price'],
-                    last_price_change=price_change
-                )
+        display_listings = [
+            DisplayListing(
+                id=row['id'],
+                title=row['title'],
+                url=row['url'],
+                stock=row['stock'],
+                price=row['price'] or 0,
+                last_price_change=row['last_price_change'] or 0
+            ) for row in listings
+        ]
         end_time = time.time()
         finish_time = end_time - start_time
         print(f"Time taken: {finish_time:.2f} seconds")
-        return list(listing_map.values())
+        return display_listings
 
     async def get_all_listings_base(self) -> List[SelectListing]:
         """Get all listings without price history attatched, only last one attatched"""
@@ -72,44 +119,95 @@ class ListingRepository:
 
 
     
-    async def get_all_listings_by_user_id(self, user_id: str) -> List[SelectListing]:
-        listing_relations = await self.listing_relation_repo.get_listing_relations_by_user_id(user_id)
+    async def get_all_listings_by_user_id(self, user_id: str) -> List[DisplayListing]:
+        """The user's listings for display, one query over their relations and the materialized latest price"""
+        listings = await select_all("""
+            SELECT l.id, l.title, l.url, l.stock, ll.price, ll.last_price_change
+            FROM listing_relations lr
+            JOIN listings l ON l.id = lr.listing_id
+            LEFT JOIN listing_latest ll ON ll.listing_id = l.id
+            WHERE lr.user_id = ?
+            ORDER BY l.created_at DESC, l.id
+        """, (user_id,), as_dict=True)
+        return [
+            DisplayListing(
+                id=row['id'],
+                title=row['title'],
+                url=row['url'],
+                stock=row['stock'],
+                price=row['price'] or 0,
+                last_price_change=row['last_price_change'] or 0
+            ) for row in listings
+        ]
 
-        listings = []
-        for lr in listing_relations:
-            listing = await select_one("""
-            SELECT l.*, ph.price, ph.date, ph.currency 
-            FROM listings l
-            LEFT JOIN price_history ph ON l.id = ph.listing_id
-            WHERE l.id = ? 
-        """, (lr['listing_id'], ), as_dict=True)
-            listings.append(listing)
-        listing_map = {}
-        for row in listings:
-            existing_listing = listing_map.get(row['id'], None) 
-            price_change = 0
-            if existing_listing and existing_listing.price != row['price']:
-                #found price change
-                price_change = row['price'] - existing_listing.price
-            if price_change != 0 or existing_listing is None:
-                listing_map[row['id']] = DisplayListing(
-                    id=row['id'],
-                    title=row['title'], 
-                    url=row['url'],
-                    stock=row['stock'],
-                    price=row['price'],
-                    last_price_change=price_change
-                )
-        return list(listing_map.values())
+    async def get_listings_page(self, user_id: str, query: ListingQuery) -> Tuple[List[dict], Optional[str]]:
+        """A page of the user's listings, filtered, sorted and cut at the keyset cursor in SQL.
+        Returns rows with the selected fields and the cursor for the next page, None on the last one."""
+        if query.sort not in LISTING_SORT_COLUMNS:
+            raise ValueError(f"Unknown sort: {query.sort}")
+        fields = query.fields or DISPLAY_FIELDS
+        unknown_fields = [field for field in fields if field not in LISTING_FIELD_COLUMNS]
+        if unknown_fields:
+            raise ValueError(f"Unknown fields: {', '.join(unknown_fields)}")
+        if "id" not in fields:
+            fields = ["id"] + fields
+        sort_column = LISTING_SORT_COLUMNS[query.sort]
+        direction, comparison = ("DESC", "<") if query.descending else ("ASC", ">")
+
+        conditions = ["lr.user_id = ?"]
+        params: List[Any] = [user_id]
+        if query.in_stock is not None:
+            conditions.append("l.stock > 0" if query.in_stock else "l.stock = 0")
+        if query.min_price is not None:
+            conditions.append("COALESCE(ll.price, 0) >= ?")
+            params.append(query.min_price)
+        if query.max_price is not None:
+            conditions.append("COALESCE(ll.price, 0) <= ?")
+            params.append(query.max_price)
+        if query.changed_since is not None:
+            changed_since = query.changed_since
+            # changed_at holds naive local times, an aware datetime is converted to that first
+            if changed_since.tzinfo is not None:
+                changed_since = changed_since.astimezone().replace(tzinfo=None)
+            conditions.append("ll.changed_at >= ?")
+            params.append(changed_since.isoformat())
+        if query.cursor:
+            sort_value, listing_id = decode_cursor(query.cursor)
+            conditions.append(f"({sort_column} {comparison} ? OR ({sort_column} = ? AND l.id {comparison} ?))")
+            params += [sort_value, sort_value, listing_id]
+
+        columns = ", ".join(f"{LISTING_FIELD_COLUMNS[field]} AS {field}" for field in fields)
+        sql = f"""
+            SELECT {columns}, {sort_column} AS cursor_value
+            FROM listing_relations lr
+            JOIN listings l ON l.id = lr.listing_id
+            LEFT JOIN listing_latest ll ON ll.listing_id = l.id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY {sort_column} {direction}, l.id {direction}
+        """
+        limit = min(query.limit, MAX_PAGE_SIZE) if query.limit else None
+        if limit:
+            # One extra row tells whether there is a next page
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+        rows = await select_all(sql, tuple(params), as_dict=True)
+
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["cursor_value"], rows[-1]["id"])
+        for row in rows:
+            del row["cursor_value"]
+        return rows, next_cursor
 
     async def get_all_listings(self) -> List[SelectListing]:
         """Get all listings with their price history"""
         start_time = time.time()
         listings = await select_all("""
-            SELECT l.*, ph.price, ph.date, ph.currency 
+            SELECT l.*, ph.price, ph.date, ph.currency, ph.last_seen
             FROM listings l
             LEFT JOIN price_history ph ON l.id = ph.listing_id
-            ORDER BY l.created_at DESC
+            ORDER BY l.created_at DESC, ph.date DESC
         """, as_dict=True)
 
         listing_map = {}
@@ -127,7 +225,8 @@ class ListingRepository:
                     SelectPriceHistory(
                         price=row['price'],
                         date=row['date'],
-                        currency=row['currency']
+                        currency=row['currency'],
+                        last_seen=row['last_seen']
                     )
                 )
         end_time = time.time()
@@ -138,7 +237,7 @@ class ListingRepository:
     async def get_listing_by_id(self, listing_id: str) -> Optional[SelectListing]:
         """Get single listing by ID with price history"""
         rows = await select_all("""
-            SELECT l.*, ph.price, ph.date, ph.currency
+            SELECT l.*, ph.price, ph.date, ph.currency, ph.last_seen
             FROM listings l 
             LEFT JOIN price_history ph ON l.id = ph.listing_id
             WHERE l.id = ?
@@ -162,7 +261,8 @@ class ListingRepository:
                     SelectPriceHistory(
                         price=row['price'],
                         date=row['date'],
-                        currency=row['currency']
+                        currency=row['currency'],
+                        last_seen=row['last_seen']
                     )
                 )
 
@@ -171,7 +271,7 @@ class ListingRepository:
     async def get_listing_by_url(self, url: str) -> Optional[SelectListing]:
         """Get single listing by URL with price history"""
         rows = await select_all("""
-            SELECT l.*, ph.price, ph.date, ph.currency
+            SELECT l.*, ph.price, ph.date, ph.currency, ph.last_seen
             FROM listings l
             LEFT JOIN price_history ph ON l.id = ph.listing_id 
             WHERE l.url = ?
@@ -195,7 +295,8 @@ class ListingRepository:
                     SelectPriceHistory(
                         price=row['price'],
                         date=row['date'],
-                        currency=row['currency']
+                        currency=row['currency'],
+                        last_seen=row['last_seen']
                     )
                 )
 
@@ -203,19 +304,15 @@ class ListingRepository:
 
     async def upsert_listing(self, listing: InsertListing, user_id: Optional[str]) -> str:
         """Insert or update listing in database"""
-        await execute_query("""
-            INSERT INTO listings (id, title, url, stock) 
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(id) DO UPDATE SET
-                title = excluded.title,
-                url = excluded.url,
-                stock = excluded.stock
-        """, (listing.id, listing.title, listing.url, listing.stock))
+        await execute_query(UPSERT_LISTING_QUERY, (listing.id, listing.title, listing.url, listing.stock))
         if user_id:
             ## Also insert listing relation
             await self.listing_relation_repo.insert_listing_relation(user_id, listing.id)
         return listing.id
 
+    async def upsert_listings(self, conn: aiosqlite.Connection, listings: List[InsertListing]):
+        """Batch upsert on a connection inside a transaction"""
+        await conn.executemany(UPSERT_LISTING_QUERY, [(listing.id, listing.title, listing.url, listing.stock) for listing in listings])
 
     async def delete_listing(self, listing_id: str, user_id: str) -> bool:
         await self.listing_relation_repo.delete_listing_relation(listing_id, user_id)
@@ -223,5 +320,6 @@ class ListingRepository:
         listing_relations = await self.listing_relation_repo.get_listing_relations_by_listing_id(listing_id)
         if len(listing_relations) == 0:
             await PriceHistoryRepository().delete_price_history(listing_id)
-            result = await execute_query("DELETE FROM listings WHERE id = ?", (listing_id,))
+            await ListingLatestRepository().delete_latest(listing_id)
+            result = await execute_update("DELETE FROM listings WHERE id = ?", (listing_id,))
             return result > 0
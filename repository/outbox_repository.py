@@ -0,0 +1,52 @@
+import time
+from typing import List
+from classes import InsertNotification, SelectNotification
+from data import WRITE_PRIORITY_BACKGROUND, execute_query_many, run_in_transaction, select_all
+
+
+class OutboxRepository:
+    """Notification intents waiting for the delivery worker"""
+
+    async def enqueue(self, notifications: List[InsertNotification]):
+        """Idempotent: a notification whose key is already in the outbox is dropped"""
+        now = time.time()
+
+        async def write(conn):
+            await conn.executemany("""
+                INSERT OR IGNORE INTO notification_outbox (idempotency_key, channel, recipient, message, next_attempt_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(x.idempotency_key, x.channel, x.recipient, x.message, now) for x in notifications])
+        await run_in_transaction(write, WRITE_PRIORITY_BACKGROUND)
+
+    async def get_due(self, now: float, limit: int) -> List[SelectNotification]:
+        rows = await select_all("""
+            SELECT id, idempotency_key, channel, recipient, message, attempts FROM notification_outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY id
+            LIMIT ?
+        """, (now, limit), as_dict=True)
+        return [SelectNotification(**row) for row in rows]
+
+    async def mark_sent(self, ids: List[int]):
+        await execute_query_many("UPDATE notification_outbox SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP WHERE id = ?", [(id,) for id in ids])
+
+    async def mark_retry(self, ids: List[int], next_attempt_at: float, error: str):
+        await execute_query_many("UPDATE notification_outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?", [(next_attempt_at, error, id) for id in ids])
+
+    async def mark_failed(self, ids: List[int], error: str):
+        await execute_query_many("UPDATE notification_outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?", [(error, id) for id in ids])
+
+    async def delete_finished(self, sent_days: float, failed_days: float) -> int:
+        """Sent rows older than sent_days and failed ones older than failed_days, timestamps are UTC"""
+        async def delete(conn):
+            cursor = await conn.execute("""
+                DELETE FROM notification_outbox
+                WHERE (status = 'sent' AND sent_at < datetime('now', ?))
+                OR (status = 'failed' AND created_at < datetime('now', ?))
+            """, (f"-{sent_days} days", f"-{failed_days} days"))
+            return cursor.rowcount
+        return await run_in_transaction(delete, WRITE_PRIORITY_BACKGROUND)
+
+    async def get_next_attempt_at(self) -> float | None:
+        rows = await select_all("SELECT MIN(next_attempt_at) FROM notification_outbox WHERE status = 'pending'")
+        return rows[0][0] if rows else None
@@ -1,6 +1,12 @@
-from typing import List
+import os
+from typing import List, Optional, Tuple
+import aiosqlite
 from classes import InsertPriceHistory, SelectPriceHistory
-from data import execute_query_many, select_all, execute_query
+from data import execute_query_many, get_db_connection, select_all, execute_query, select_one
+
+# "changes" stores a row only when price, currency or stock move and stretches its last_seen otherwise,
+# "all" stores every observation
+PRICE_HISTORY_MODE = os.getenv("PRICE_HISTORY_MODE") or "changes"
 
 
 class PriceHistoryRepository:
@@ -8,21 +14,107 @@ class PriceHistoryRepository:
         self.price_history = []
 
     async def get_price_history(self, listing_id: str):
-        results = await select_all("SELECT * FROM price_history WHERE listing_id = ?", (listing_id,), as_dict=True)
-        return [SelectPriceHistory(price=result["price"], date=result["date"], currency=result["currency"]) for result in results]
+        results = await select_all("SELECT * FROM price_history WHERE listing_id = ? ORDER BY date", (listing_id,), as_dict=True)
+        return [SelectPriceHistory(price=result["price"], date=result["date"], currency=result["currency"], last_seen=result["last_seen"]) for result in results]
+
+    async def add_price_history(self, listing_id: str, price_history: InsertPriceHistory, stock: Optional[int] = None):
+        if PRICE_HISTORY_MODE == "changes":
+            last_row = await select_one("SELECT rowid, price, currency, stock FROM price_history WHERE listing_id = ? ORDER BY date DESC LIMIT 1", (listing_id,), as_dict=True)
+            if last_row and (last_row["price"], last_row["currency"], last_row["stock"]) == (price_history.price, price_history.currency, stock):
+                await execute_query("UPDATE price_history SET last_seen = ? WHERE rowid = ?", (price_history.date, last_row["rowid"]))
+                return None
+        return await execute_query("INSERT INTO price_history (listing_id, price, date, currency, stock, last_seen) VALUES (?, ?, ?, ?, ?, ?)", (listing_id, price_history.price, price_history.date, price_history.currency, stock, price_history.date))
 
-    async def add_price_history(self, listing_id: str, price_history: InsertPriceHistory):
-        return await execute_query("INSERT INTO price_history (listing_id, price, date, currency) VALUES (?, ?, ?, ?)", (listing_id, price_history.price, price_history.date, price_history.currency))
+    async def add_price_histories(self, conn: aiosqlite.Connection, observations: List[Tuple[str, InsertPriceHistory, Optional[int]]]) -> int:
+        """Batch add_price_history for (listing_id, price, stock) observations in order, on a connection inside
+        a transaction. Returns the number of inserted rows."""
+        # listing_id -> (newest row, (price, currency, stock)), the row is a rowid or a pending insert
+        newest = {}
+        if PRICE_HISTORY_MODE == "changes" and observations:
+            listing_ids = list({listing_id for listing_id, _, _ in observations})
+            cursor = await conn.execute(f"""
+                SELECT listing_id, rid, price, currency, stock FROM (
+                    SELECT listing_id, rowid AS rid, price, currency, stock,
+                        ROW_NUMBER() OVER (PARTITION BY listing_id ORDER BY date DESC) AS position
+                    FROM price_history WHERE listing_id IN ({",".join("?" * len(listing_ids))})
+                ) WHERE position = 1
+            """, listing_ids)
+            for listing_id, rowid, price, currency, stock in await cursor.fetchall():
+                newest[listing_id] = (rowid, (price, currency, stock))
+            await cursor.close()
+        inserts = []
+        updates = []
+        for listing_id, price_history, stock in observations:
+            value = (price_history.price, price_history.currency, stock)
+            previous = newest.get(listing_id)
+            if PRICE_HISTORY_MODE == "changes" and previous and previous[1] == value:
+                if isinstance(previous[0], list):
+                    previous[0][5] = price_history.date
+                else:
+                    updates.append((price_history.date, previous[0]))
+                continue
+            row = [listing_id, price_history.price, price_history.date, price_history.currency, stock, price_history.date]
+            inserts.append(row)
+            newest[listing_id] = (row, value)
+        if updates:
+            await conn.executemany("UPDATE price_history SET last_seen = ? WHERE rowid = ?", updates)
+        if inserts:
+            await conn.executemany("INSERT INTO price_history (listing_id, price, date, currency, stock, last_seen) VALUES (?, ?, ?, ?, ?, ?)", inserts)
+        return len(inserts)
 
     async def delete_price_history(self, listing_id: str):
         return await execute_query("DELETE FROM price_history WHERE listing_id = ?", (listing_id,))
     
     async def add_many_price_histories(self, listing_id: str, price_histories: List[InsertPriceHistory]):
-        values = [(listing_id, ph.price, ph.date, ph.currency) 
+        values = [(listing_id, ph.price, ph.date, ph.currency, ph.date) 
                  for ph in price_histories]
         
         query = """
-            INSERT INTO price_history (listing_id, price, date, currency)
-            VALUES (?, ?, ?, ?)
+            INSERT INTO price_history (listing_id, price, date, currency, last_seen)
+            VALUES (?, ?, ?, ?, ?)
         """
         return await execute_query_many(query, values)
+
+    async def compact_price_history(self) -> int:
+        """Collapse runs of consecutive identical observations into their first row, stretching its last_seen.
+        Returns the number of deleted rows."""
+        async with get_db_connection() as conn:
+            try:
+                await conn.execute("BEGIN")
+                await conn.execute("DROP TABLE IF EXISTS temp.price_history_runs")
+                await conn.execute("""
+                    CREATE TEMP TABLE price_history_runs AS
+                    WITH ordered AS (
+                        SELECT rowid AS rid, listing_id, date, COALESCE(last_seen, date) AS seen,
+                            CASE WHEN LAG(price) OVER w IS price AND LAG(currency) OVER w IS currency AND LAG(stock) OVER w IS stock
+                                THEN 0 ELSE 1 END AS is_change
+                        FROM price_history
+                        WINDOW w AS (PARTITION BY listing_id ORDER BY date)
+                    ), runs AS (
+                        SELECT rid, listing_id, date, seen,
+                            SUM(is_change) OVER (PARTITION BY listing_id ORDER BY date ROWS UNBOUNDED PRECEDING) AS run
+                        FROM ordered
+                    ), firsts AS (
+                        SELECT listing_id, run, seen,
+                            FIRST_VALUE(rid) OVER (PARTITION BY listing_id, run ORDER BY date) AS keep_rid
+                        FROM runs
+                    )
+                    SELECT listing_id, run, keep_rid, MAX(seen) AS last_seen
+                    FROM firsts
+                    GROUP BY listing_id, run, keep_rid
+                """)
+                await conn.execute("""
+                    UPDATE price_history SET last_seen = (
+                        SELECT r.last_seen FROM temp.price_history_runs r WHERE r.keep_rid = price_history.rowid
+                    )
+                    WHERE rowid IN (SELECT keep_rid FROM temp.price_history_runs)
+                """)
+                cursor = await conn.execute("DELETE FROM price_history WHERE rowid NOT IN (SELECT keep_rid FROM temp.price_history_runs)")
+                deleted = cursor.rowcount
+                await cursor.close()
+                await conn.execute("DROP TABLE temp.price_history_runs")
+                await conn.commit()
+                return deleted
+            except Exception:
+                await conn.rollback()
+                raise
@@ -1,7 +1,12 @@
-
+import uuid
+from typing import Optional
 from classes import SelectReminder, InsertReminder
-from data import select_all, execute_query
+from data import select_all, execute_query, execute_update
+from reminder_rules import reminder_index
+
 
+def to_reminder(row: dict) -> SelectReminder:
+    return SelectReminder(id=row['id'], method=row['method'], target_product_id=row['target_product_id'], type=row['type'], threshold=row['threshold'], user_id=row['user_id'])
 
 class ReminderRepository:
     def __init__(self):
@@ -9,31 +14,46 @@ class ReminderRepository:
 
     async def get_and_update_reminders(self):
         reminders = await select_all("SELECT * FROM reminders", as_dict=True)
-        self.reminders = [SelectReminder(id=reminder['id'], method=reminder['method'], target_product_id=reminder['target_product_id'], type=reminder['type']) for reminder in reminders]
+        self.reminders = [to_reminder(reminder) for reminder in reminders]
         return self.reminders
 
-    async def add_reminder(self, reminder: InsertReminder):
-        #check if already exists
-        await self.get_and_update_reminders()
-        if [x for x in self.reminders if x.method == reminder.method and x.target_product_id == reminder.target_product_id]:
-            return
-        await execute_query("INSERT INTO reminders (method, target_product_id, type) VALUES (?, ?, ?)", (reminder.method, reminder.target_product_id, reminder.type))
+    async def load_index(self):
+        """Fill the shared reminder index from the table once, add and delete keep it current after that"""
+        if not reminder_index.loaded:
+            reminder_index.load(await self.get_and_update_reminders())
 
-    async def delete_reminder(self, reminder_id: str):
-        await execute_query("DELETE FROM reminders WHERE id = ?", (reminder_id,))
+    async def add_reminder(self, reminder: InsertReminder) -> Optional[SelectReminder]:
+        await self.load_index()
+        #check if already exists
+        if reminder_index.find(reminder.user_id, reminder.method, reminder.target_product_id, reminder.type, reminder.threshold):
+            return None
+        new_reminder = SelectReminder(id=str(uuid.uuid4()), method=reminder.method, target_product_id=reminder.target_product_id, type=reminder.type, threshold=reminder.threshold, user_id=reminder.user_id)
+        await execute_query("INSERT INTO reminders (id, method, target_product_id, type, threshold, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+                            (new_reminder.id, new_reminder.method, new_reminder.target_product_id, new_reminder.type, new_reminder.threshold, new_reminder.user_id))
+        reminder_index.add(new_reminder)
+        return new_reminder
+
+    async def delete_reminder(self, reminder_id: str, user_id: str) -> bool:
+        """Only the owner can delete a reminder"""
+        deleted = await execute_update("DELETE FROM reminders WHERE id = ? AND user_id = ?", (reminder_id, user_id))
+        if deleted:
+            reminder_index.remove(reminder_id)
+        return deleted > 0
+
+    async def get_reminders_by_user_id(self, user_id: str):
+        reminders = await select_all("SELECT * FROM reminders WHERE user_id = ?", (user_id,), as_dict=True)
+        return [to_reminder(reminder) for reminder in reminders]
 
     async def get_reminders_by_target_product_id(self, target_product_id: str, use_cache: bool = False):
         if use_cache:
-            result = [x for x in self.reminders if x.target_product_id == target_product_id]
-            return result
+            await self.load_index()
+            return [reminder for rules in reminder_index.rules.get(target_product_id, {}).values() for reminder in rules.values()]
         reminders = await select_all("SELECT * FROM reminders WHERE target_product_id = ?", (target_product_id,), as_dict=True)
-        return [SelectReminder(id=reminder['id'], method=reminder['method'], target_product_id=reminder['target_product_id'], type=reminder['type']) for reminder in reminders]
+        return [to_reminder(reminder) for reminder in reminders]
 
     async def get_reminders_by_method(self, method: str, use_cache: bool = False):
         if use_cache:
             result = [x for x in self.reminders if x.method == method]
             return result
         reminders = await select_all("SELECT * FROM reminders WHERE method = ?", (method,), as_dict=True)
-        return [SelectReminder(id=reminder['id'], method=reminder['method'], target_product_id=reminder['target_product_id'], type=reminder['type']) for reminder in reminders]
-
-
+        return [to_reminder(reminder) for reminder in reminders]
@@ -1,5 +1,7 @@
+from typing import List
 from classes import Settings
-from data import execute_query, select_one
+from data import execute_query, select_all, select_one
+from notification_routes import notification_routes
 
 class SettingsRepository:
     
@@ -16,9 +18,20 @@ class SettingsRepository:
             return Settings(interval=settings[1], phone_number=settings[2], telegram_userid=settings[3], email=settings[4], user_id="")
         return Settings(interval=40, phone_number="", telegram_userid="", email="", user_id="")
     
+    async def get_all_settings(self) -> List[Settings]:
+        rows = await select_all("SELECT interval, phone_number, telegram_userid, email, user_id FROM settings")
+        return [Settings(interval=row[0], phone_number=row[1] or "", telegram_userid=row[2] or "", email=row[3] or "", user_id=row[4]) for row in rows]
+
+    async def load_routes(self):
+        """Fill the shared notification routes once, insert and update keep them current after that"""
+        if not notification_routes.loaded:
+            notification_routes.load(await self.get_all_settings())
+
     async def insert_settings(self, settings: Settings):
         await execute_query("INSERT INTO settings (interval, phone_number, telegram_userid, email, user_id) VALUES (? , ?, ?, ?, ?)", (settings.interval, settings.phone_number, settings.telegram_userid, settings.email, settings.user_id))
+        notification_routes.update(settings)
 
     async def update_settings(self, settings: Settings):
         await execute_query("UPDATE settings SET interval = ?, phone_number = ?, telegram_userid = ?, email = ? WHERE user_id = ?", (settings.interval, settings.phone_number, settings.telegram_userid, settings.email, settings.user_id))
+        notification_routes.update(settings)
 
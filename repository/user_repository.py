@@ -1,7 +1,7 @@
 
 from typing import Optional
 import uuid
-from classes import InsertUser, SelectUser
+from classes import InsertUser, Principal, SelectUser
 from data import execute_query, select_one
 
 
@@ -12,6 +12,13 @@ class UserRepository:
         if result:
             return SelectUser(id=result['id'], created_at=result['created_at'], email=result['email'], password=result['password'] )
         return None
+
+    async def get_principal_by_id(self, id: str) -> Optional[Principal]:
+        """Just what authentication needs, the password hash isn't read"""
+        result = await select_one("SELECT id, email, created_at FROM users WHERE id = ?", (id,))
+        if result:
+            return Principal(id=result[0], email=result[1], created_at=result[2])
+        return None
     
     async def insert_user(self, user: InsertUser) -> str:
         generated_uuid = str(uuid.uuid4())
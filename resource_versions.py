@@ -0,0 +1,30 @@
+import hashlib
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterable, Tuple
+
+# Resources the front-end polls
+LISTINGS = "listings"
+REMINDERS = "reminders"
+SETTINGS = "settings"
+NEXT_UPDATE = "next-update"
+
+
+class ResourceVersions:
+    """Per-user change counters for the polled resources, bumped by the write paths.
+    ETags are derived from them so a conditional GET can be answered without touching the database.
+    The counters live in memory, the process epoch in every ETag makes a restart invalidate them all."""
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex
+        self.counters: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    def bump(self, user_ids: Iterable[str], resource: str):
+        for user_id in user_ids:
+            self.counters[(user_id, resource)] += 1
+
+    def etag(self, user_id: str, resource: str, *variant) -> str:
+        """Weak ETag for the user's current version of resource, variant covers anything else the response depends on"""
+        key = "|".join(str(part) for part in (self.epoch, resource, self.counters.get((user_id, resource), 0), *variant))
+        return f'W/"{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"'
+
+resource_versions = ResourceVersions()
@@ -0,0 +1,122 @@
+import heapq
+import os
+import random
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Interval for listings nobody with settings tracks, same as SettingsRepository's default
+DEFAULT_REFRESH_INTERVAL = 40
+# Bounds for the adapted interval, whatever the user settings and backoff say
+REFRESH_MIN_INTERVAL = int(os.getenv("REFRESH_MIN_INTERVAL") or 10)
+REFRESH_MAX_INTERVAL = int(os.getenv("REFRESH_MAX_INTERVAL") or 3600)
+# Multiplier applied after every refresh that saw no change
+REFRESH_BACKOFF_FACTOR = float(os.getenv("REFRESH_BACKOFF_FACTOR") or 1.5)
+# Multiplier right after a change, polling faster than the user's interval for a while
+REFRESH_CHANGED_BACKOFF = 0.5
+LOW_STOCK_THRESHOLD = 3
+
+class ScheduledListing:
+    def __init__(self, listing_id: str, url: str, interval: int, due: float):
+        self.listing_id = listing_id
+        self.url = url
+        # Interval from user settings, the adapted one is interval * backoff
+        self.interval = interval
+        self.backoff = 1.0
+        self.has_reminders = False
+        self.stock: Optional[int] = None
+        self.due = due
+        self.in_flight = False
+
+    def is_low_stock(self) -> bool:
+        return self.stock is not None and 0 < self.stock <= LOW_STOCK_THRESHOLD
+
+    def effective_interval(self) -> float:
+        backoff = self.backoff
+        # Listings someone waits on never get polled slower than asked for
+        if self.has_reminders or self.is_low_stock():
+            backoff = min(backoff, 1.0)
+        return min(max(self.interval * backoff, REFRESH_MIN_INTERVAL), REFRESH_MAX_INTERVAL)
+
+    def observe(self, changed: bool, stock: Optional[int], failed: bool = False):
+        """Exponential backoff while nothing changes, tighten again as soon as something does.
+        A failed refresh observed nothing and leaves the backoff as it was."""
+        if failed:
+            return
+        if stock is not None:
+            self.stock = stock
+        if changed:
+            self.backoff = REFRESH_CHANGED_BACKOFF
+        else:
+            self.backoff = min(max(self.backoff, 1.0) * REFRESH_BACKOFF_FACTOR, REFRESH_MAX_INTERVAL / max(self.interval, 1))
+
+class RefreshScheduler:
+    """Min-heap of (due_time, listing_id). Rescheduling pushes a new heap entry and
+    leaves the old one behind, stale entries are skipped when they reach the top."""
+    def __init__(self):
+        self.heap: List[Tuple[float, str]] = []
+        self.entries: Dict[str, ScheduledListing] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def push(self, entry: ScheduledListing):
+        heapq.heappush(self.heap, (entry.due, entry.listing_id))
+
+    def is_current(self, due: float, listing_id: str) -> bool:
+        entry = self.entries.get(listing_id)
+        return entry is not None and not entry.in_flight and entry.due == due
+
+    def sync(self, targets: Iterable[Tuple[str, str, Optional[int]]], now: float, reminder_listing_ids: Set[str] = frozenset()):
+        """Reconcile with (listing_id, url, interval) rows from the database and the listings with active reminders.
+        New listings get a random first due time within their interval so a restart doesn't fetch everything at once."""
+        seen = set()
+        for listing_id, url, interval in targets:
+            interval = interval if interval and interval > 0 else DEFAULT_REFRESH_INTERVAL
+            seen.add(listing_id)
+            entry = self.entries.get(listing_id)
+            if entry is None:
+                entry = ScheduledListing(listing_id, url, interval, now)
+                entry.has_reminders = listing_id in reminder_listing_ids
+                entry.due = now + random.uniform(0, entry.effective_interval())
+                self.entries[listing_id] = entry
+                self.push(entry)
+                continue
+            entry.url = url
+            entry.interval = interval
+            entry.has_reminders = listing_id in reminder_listing_ids
+            # Pull the next refresh in when the interval got shorter, a longer one applies from the next refresh
+            if not entry.in_flight and now + entry.effective_interval() < entry.due:
+                entry.due = now + entry.effective_interval()
+                self.push(entry)
+        for listing_id in [listing_id for listing_id in self.entries if listing_id not in seen]:
+            del self.entries[listing_id]
+
+    def pop_due(self, now: float, limit: Optional[int] = None) -> List[ScheduledListing]:
+        due = []
+        while self.heap and self.heap[0][0] <= now and (limit is None or len(due) < limit):
+            due_time, listing_id = heapq.heappop(self.heap)
+            if not self.is_current(due_time, listing_id):
+                continue
+            entry = self.entries[listing_id]
+            entry.in_flight = True
+            due.append(entry)
+        # Listings with reminders go first when more are due than can be dispatched at once
+        due.sort(key=lambda entry: (not entry.has_reminders, entry.due))
+        return due
+
+    def complete(self, listing_id: str, now: float, changed: bool = False, stock: Optional[int] = None, failed: bool = False):
+        entry = self.entries.get(listing_id)
+        if entry is None:
+            return
+        entry.in_flight = False
+        entry.observe(changed, stock, failed)
+        entry.due = now + entry.effective_interval()
+        self.push(entry)
+
+    def next_due(self) -> Optional[float]:
+        while self.heap and not self.is_current(*self.heap[0]):
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def next_due_for(self, listing_ids: Iterable[str]) -> Optional[float]:
+        dues = [self.entries[listing_id].due for listing_id in listing_ids if listing_id in self.entries]
+        return min(dues) if dues else None
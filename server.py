@@ -3,25 +3,37 @@ load_dotenv(override=True)
 import asyncio
 import os
 import time
+from datetime import datetime
+from typing import Optional
 from fastapi import Depends, FastAPI, HTTPException, Response, Request, WebSocket, WebSocketDisconnect
 from fastapi.concurrency import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.params import Query
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, HTMLResponse
 from checker import Checker
 from pydantic import BaseModel
 import logging
-from errors import InvalidUrlError, ListingNotFoundError
+from errors import CaptchaError, CircuitOpenError, InvalidUrlError, ListingNotFoundError, PasswordBusyError
 from repository.listing_repository import ListingRepository
 from repository.zip_repository import ZipRepository
 from services.ws_service import ws_service
 from services.auth_service import AuthService
 from services.listing_service import ListingService
 from services.reminder_service import ReminderService
-from classes import CustomDate, LoginUser, RegisterUser, SelectUser, Settings, Token
-from data import init_db
+from classes import CustomDate, InsertReminder, ListingQuery, LoginUser, Principal, RegisterUser, Settings, Token
+from data import close_pool, init_db, open_pool
+from debug_snapshots import snapshot_buffer
+from ebay import ebay_client
+from ebay_urls import get_item_id
+from migrations import run_migrations
+from notification_worker import notification_worker
+from password_hasher import password_hasher
+from relation_index import relation_index
+from reminder_rules import validate_rule
+from resource_versions import LISTINGS, NEXT_UPDATE, REMINDERS, SETTINGS, resource_versions
 from services.scraper_service import ScraperService
 from services.settings_service import SettingsService
+from session_cache import session_cache
 from services.statistics_service import StatisticsService
 from telegram_bot import telegram_app
 
@@ -50,6 +62,7 @@ class ReminderRequest(BaseModel):
     method: str
     target_product_id: str
     type: str
+    threshold: Optional[float] = None
 
 async def validate_user(request: Request):
     auth_service = AuthService()
@@ -64,22 +77,48 @@ async def validate_user(request: Request):
     else:
         raise HTTPException(status_code=401, detail="No user found")
 
+def client_ip(request: Request) -> Optional[str]:
+    return request.client.host if request.client else None
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """304 when If-None-Match already names etag, otherwise tag the response and carry on"""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in tags or etag.removeprefix("W/") in tags:
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Start the update loop task
+    await open_pool()
     await init_db()
+    await run_migrations()
     run_tg = os.getenv("RUN_TG") or "TRUE"
     if run_tg == "FALSE":
         run_tg = False
     else:
         run_tg = True
-    asyncio.create_task(checker.update_loop())
+    update_task = asyncio.create_task(checker.update_loop())
+    notification_task = asyncio.create_task(notification_worker.run())
     if run_tg:
         await telegram_app.initialize()
         await telegram_app.start()
         await telegram_app.updater.start_polling()
 
     yield
+    # Everything that writes has to stop before the pool closes under it
+    update_task.cancel()
+    notification_task.cancel()
+    await asyncio.gather(update_task, notification_task, return_exceptions=True)
+    await checker.close()
+    await notification_worker.close()
+    password_hasher.close()
+    await ebay_client.close()
+    await close_pool()
     if run_tg:
         await telegram_app.updater.stop()
         await telegram_app.stop()
@@ -95,7 +134,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"], 
+    expose_headers=["Content-Disposition", "ETag"], 
 )
 
 
@@ -104,44 +143,88 @@ def get_apiversion_handler():
     return {"version": API_VERSION}
 
 @app.get('/api/reminders')
-async def get_reminders_handler(user: SelectUser = Depends(validate_user)):
-    return {"success": "OK", "body": await ReminderService().reminder_repository.get_and_update_reminders()}
+async def get_reminders_handler(request: Request, response: Response, user: Principal = Depends(validate_user)):
+    cached = not_modified(request, response, resource_versions.etag(user.id, REMINDERS))
+    if cached:
+        return cached
+    return {"success": "OK", "body": await ReminderService().reminder_repository.get_reminders_by_user_id(user.id)}
 
 @app.post('/api/reminders')
-async def add_reminder_handler(reminder: ReminderRequest, user: SelectUser = Depends(validate_user)):
+async def add_reminder_handler(reminder: ReminderRequest, user: Principal = Depends(validate_user)):
+    error = validate_rule(reminder.type, reminder.threshold)
+    if error:
+        return {"error": error}
     try:
-        await ReminderService().reminder_repository.add_reminder(reminder)
+        await ReminderService().reminder_repository.add_reminder(InsertReminder(method=reminder.method, target_product_id=reminder.target_product_id, type=reminder.type, threshold=reminder.threshold, user_id=user.id))
+        resource_versions.bump([user.id], REMINDERS)
+        checker.request_schedule_sync()
         return {"success": "Ok"}
     except Exception as e:
         print(str(e))
         return {"error": "Failed"}
 
 @app.get('/api/settings')
-async def get_settings_handler(user: SelectUser = Depends(validate_user)):
+async def get_settings_handler(request: Request, response: Response, user: Principal = Depends(validate_user)):
+    cached = not_modified(request, response, resource_versions.etag(user.id, SETTINGS))
+    if cached:
+        return cached
     return {"success": "OK", "body": await SettingsService().settings_repository.get_settings_by_user_id(user.id)}
 
 
 @app.post('/api/settings')
-async def update_settings_handler(settings: Settings, user: SelectUser = Depends(validate_user)):
+async def update_settings_handler(settings: Settings, user: Principal = Depends(validate_user)):
+    if settings.user_id and settings.user_id != user.id:
+        raise HTTPException(status_code=403, detail="Cannot change another user's settings")
+    # Settings also decide where the user's reminders are delivered, only ever the caller's own
+    settings.user_id = user.id
     await SettingsService().settings_repository.update_settings(settings)
+    resource_versions.bump([user.id], SETTINGS)
+    resource_versions.bump([user.id], NEXT_UPDATE)
+    checker.request_schedule_sync()
     return {"success": "OK"}
 
 @app.get("/api/listings")
-async def get_listings_handler(user: SelectUser = Depends(validate_user)):
+async def get_listings_handler(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, description="Page size, every listing when omitted"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    sort: str = Query("created_at", description="created_at, price or last_price_change"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    in_stock: Optional[bool] = Query(None),
+    min_price: Optional[float] = Query(None),
+    max_price: Optional[float] = Query(None),
+    changed_since: Optional[datetime] = Query(None, description="Only listings whose price changed since"),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return"),
+    user: Principal = Depends(validate_user)):
+    # The query string picks the page, sort and fields, so it is part of the version
+    cached = not_modified(request, response, resource_versions.etag(user.id, LISTINGS, request.url.query))
+    if cached:
+        return cached
     start = time.time()
-    listings = await ListingService().listing_repository.get_all_listings_by_user_id(user.id)
-    # Convert listings to a list of dictionaries
+    query = ListingQuery(limit=limit, cursor=cursor, sort=sort, descending=order == "desc", in_stock=in_stock,
+                         min_price=min_price, max_price=max_price, changed_since=changed_since,
+                         fields=[field.strip() for field in fields.split(",") if field.strip()] if fields else None)
+    try:
+        listings, next_cursor = await ListingService().listing_repository.get_listings_page(user.id, query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     end = time.time()
     elapsed = end - start
     print(f"Listings handler: {elapsed:.2f}")
-    return {"success": "OK", "body": listings}
+    return {"success": "OK", "body": listings, "next_cursor": next_cursor}
 
 @app.post("/api/listings")
-async def add_listing_handler(listing: ListingRequest, user: SelectUser = Depends(validate_user)):
+async def add_listing_handler(listing: ListingRequest, user: Principal = Depends(validate_user)):
     try:
-        existing_listing = await ListingRepository().get_listing_by_url(listing.url)
+        item_id = get_item_id(listing.url)
+        if item_id:
+            existing_listing = await ListingRepository().get_listing_by_id(item_id)
+        else:
+            existing_listing = await ListingRepository().get_listing_by_url(listing.url)
         insert_result = await checker.add_or_update_listing(listing.url, existing_listing, user.id)
         if insert_result:
+            checker.request_schedule_sync()
             return {"success": "OK", "body": {"id": insert_result}}
         else:
             raise HTTPException(status_code=500, detail="Failed to add listing")
@@ -151,11 +234,17 @@ async def add_listing_handler(listing: ListingRequest, user: SelectUser = Depend
     except ListingNotFoundError as e:
         print(str(e))
         return {"error": "Listing not found"}
+    except (CaptchaError, CircuitOpenError) as e:
+        print(str(e))
+        return {"error": "eBay is limiting requests, try again later"}
 
 @app.delete("/api/listings")
-async def delete_listing_handler(id: str = Query(..., description="Listing id"), user: SelectUser = Depends(validate_user)):
+async def delete_listing_handler(id: str = Query(..., description="Listing id"), user: Principal = Depends(validate_user)):
     try:
-        delete_result = await ListingService().listing_repository.delete_listing(id)
+        delete_result = await ListingService().listing_repository.delete_listing(id, user.id)
+        relation_index.remove(user.id, id)
+        resource_versions.bump([user.id], LISTINGS)
+        checker.request_schedule_sync()
         if delete_result:
             return {"success": "Ok"}
     except Exception as e:
@@ -163,9 +252,11 @@ async def delete_listing_handler(id: str = Query(..., description="Listing id"),
         return  {"error": "Failed"}
 
 @app.delete("/api/reminders")
-async def delete_listing_handler(id: str = Query(..., description="Reminder id"), user: SelectUser = Depends(validate_user)):
+async def delete_listing_handler(id: str = Query(..., description="Reminder id"), user: Principal = Depends(validate_user)):
     try:
-        delete_result = await ReminderService().reminder_repository.delete_reminder(id)
+        delete_result = await ReminderService().reminder_repository.delete_reminder(id, user.id)
+        resource_versions.bump([user.id], REMINDERS)
+        checker.request_schedule_sync()
         if delete_result:
             return {"success": "Deleted successfully"}
         return {"error": "Failed"}
@@ -174,9 +265,12 @@ async def delete_listing_handler(id: str = Query(..., description="Reminder id")
         return {"error": "Failed to delete reminders"}
 
 @app.get("/api/next-update")
-async def get_next_update_handler(user: SelectUser = Depends(validate_user)):
+async def get_next_update_handler(request: Request, response: Response, user: Principal = Depends(validate_user)):
+    cached = not_modified(request, response, checker.next_update_etag(user.id))
+    if cached:
+        return cached
     start = time.time()
-    next_update, interval = await checker.get_next_update()
+    next_update, interval = await checker.get_next_update(user.id)
     end = time.time()
     elapsed = end - start
     print(f"Nextupdate handler: {elapsed:.2f}")
@@ -187,14 +281,18 @@ async def get_next_update_handler(user: SelectUser = Depends(validate_user)):
 async def test_stats_handler():
     start_date = CustomDate(day=9, month=3, year=2025)
     end_date = CustomDate(day=10, month=3, year=2025)
-    stats = await StatisticsService().get_price_data_between_dates(listing_ebay_id="256430205325", start_date=start_date, end_date=end_date)
+    stats = await StatisticsService().get_price_data_between_dates2(listing_ebay_id="256430205325", start_date=start_date, end_date=end_date)
     return {"success": "OK", "body": stats}
 
 
 @app.post("/api/register")
-async def register_handler(user: RegisterUser, response: Response):
+async def register_handler(user: RegisterUser, request: Request, response: Response):
     auth_service = AuthService()
-    register_response = await auth_service.register(user)
+    try:
+        register_response = await auth_service.register(user, client_ip(request))
+    except PasswordBusyError as e:
+        print(str(e))
+        raise HTTPException(status_code=429, detail="Too many requests, try again shortly", headers={"Retry-After": "1"})
     if register_response.get('success'):
         session_token = register_response["body"]["token"]
         response.set_cookie(
@@ -211,9 +309,13 @@ async def register_handler(user: RegisterUser, response: Response):
     return register_response
 
 @app.post("/api/login")
-async def login_handler(user: LoginUser, response: Response):
+async def login_handler(user: LoginUser, request: Request, response: Response):
     auth_service = AuthService()
-    login_resp = await auth_service.login(user)
+    try:
+        login_resp = await auth_service.login(user, client_ip(request))
+    except PasswordBusyError as e:
+        print(str(e))
+        raise HTTPException(status_code=429, detail="Too many login attempts, try again shortly", headers={"Retry-After": "1"})
     if login_resp.get("success"):
         session_token = login_resp["body"]["token"]
         response.set_cookie(
@@ -229,7 +331,10 @@ async def login_handler(user: LoginUser, response: Response):
     return login_resp
 
 @app.get("/api/logout")
-def logout_handler(response: Response):
+def logout_handler(request: Request, response: Response):
+    session_token = request.cookies.get("session_token")
+    if session_token:
+        session_cache.invalidate_token(session_token)
     response.set_cookie(
         key="session_token",
         value='',
@@ -242,7 +347,7 @@ def logout_handler(response: Response):
     return {"success": "User logged out"}
 
 @app.get("/api/auth-validate")
-async def auth_handler(user: SelectUser = Depends(validate_user)):
+async def auth_handler(user: Principal = Depends(validate_user)):
     print("Authed user: ", user.id)
     return {"success": "User validated"}
 
@@ -266,10 +371,26 @@ async def zip_dl_handler(zip_id: str = Query(..., description="ZIP File ID")):
     return FileResponse(abspath, filename=path)
 
 @app.get("/api/ws-auth")
-async def ws_auth_handler(user: SelectUser = Depends(validate_user)):
+async def ws_auth_handler(user: Principal = Depends(validate_user)):
     ws_token = ws_service.generate_session_token(user.email, user.id)
     return {"success": "OK", "body": ws_token}
 
+@app.get("/api/debug/snapshots")
+async def debug_snapshots_handler(user: Principal = Depends(validate_user)):
+    """Pages that failed to parse, kept in memory when DEBUG_SNAPSHOTS is set"""
+    if not snapshot_buffer.enabled:
+        raise HTTPException(status_code=404, detail="Snapshots disabled")
+    snapshots = [{"index": index, "taken_at": snapshot.taken_at, "url": snapshot.url, "reason": snapshot.reason}
+                 for index, snapshot in enumerate(snapshot_buffer.get_snapshots())]
+    return {"success": "OK", "body": snapshots}
+
+@app.get("/api/debug/snapshots/{index}")
+async def debug_snapshot_handler(index: int, user: Principal = Depends(validate_user)):
+    snapshot = snapshot_buffer.get_snapshot(index) if snapshot_buffer.enabled else None
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return HTMLResponse(snapshot.html())
+
 @app.websocket('/ws/{session_token}')
 async def websocket_handler(websocket: WebSocket, session_token: str):
     await websocket.accept()
@@ -280,11 +401,13 @@ async def websocket_handler(websocket: WebSocket, session_token: str):
                 connect_resp = await ws_service.connect(session_token, websocket)
                 if connect_resp.get('success'):
                     await websocket.send_json({"type": "connection", "body": {"success":"Connected"}})
+                    # Start from a full snapshot, deltas follow from the next broadcast
+                    await checker.send_snapshot(connect_resp['user_id'])
                 else:
                     await websocket.send_json( {"type": "connection", "body": {"error":"Failed"}})
                 print(connect_resp)
             print(message)
     except WebSocketDisconnect:
-        ws_service.disconnect(session_token) 
+        ws_service.disconnect(websocket)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -2,10 +2,11 @@ from datetime import datetime, timedelta
 from jose import ExpiredSignatureError, JWTError, jwt
 import os
 from typing import Dict, Optional, Union
-import bcrypt
-from classes import InsertUser, LoginUser, RegisterUser, SelectUser, Settings
+from classes import InsertUser, LoginUser, Principal, RegisterUser, Settings
 from repository.settings_repository import SettingsRepository
+from password_hasher import password_hasher
 from repository.user_repository import UserRepository
+from session_cache import session_cache
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
@@ -18,14 +19,18 @@ class AuthService:
     def __init__(self) -> None:
         self.user_repository = UserRepository()
 
-    async def validate_user(self, token: str) -> Dict[str, Union[bool, Optional[str], Optional[SelectUser]]]:
+    async def validate_user(self, token: str) -> Dict[str, Union[bool, Optional[str], Optional[Principal]]]:
+        # Polling sends the same token over and over, a cached one skips the decode and the user lookup
+        user = session_cache.get(token)
+        if user:
+            return {"success": "OK", "body": {"user": user}}
         try:
             decoded_jwt = jwt.decode(token, SECRET_KEY, ALGORITHM)
             user_id = decoded_jwt['id']
             if user_id:
-                user = await self.user_repository.get_user_by_id(decoded_jwt['id'])
+                user = await self.user_repository.get_principal_by_id(decoded_jwt['id'])
                 if user:
-                    user.password = ''
+                    session_cache.put(token, user, decoded_jwt.get('exp'))
                     return {"success": "OK", "body": {"user": user}}
             return {"error": "No user found"}
         except ExpiredSignatureError:
@@ -36,38 +41,34 @@ class AuthService:
             print(str(e))
             return {"error": "Token failed to be validated"}
         
-    async def register(self, user: RegisterUser):
+    async def register(self, user: RegisterUser, client_ip: Optional[str] = None):
         existing_user = await self.user_repository.get_user_by_email(user.email)
         if existing_user:
             return {"error": "User already exists"}
-        hashed_password = self.hash_password(user.password)
+        hashed_password = await self.hash_password(user.password, client_ip, user.email)
         result = await self.user_repository.insert_user(InsertUser(created_at=datetime.now(), email=user.email, password=hashed_password))
         session_token = self.generate_session_token(user.email, result)
         ### Create default settings insert
         await SettingsRepository().insert_settings(Settings(user_id=result, phone_number="", telegram_userid="", email=user.email, interval=60))
         return {"success": "OK", "body": {"token": session_token, "user_id": result}}
     
-    async def login(self, user: LoginUser):
+    async def login(self, user: LoginUser, client_ip: Optional[str] = None):
         existing_user = await self.user_repository.get_user_by_email(user.email)
         if not existing_user:
             return {"error": "User does not exist"}
-        psswd_compare = self.verify_password(user.password, existing_user.password)
+        psswd_compare = await self.verify_password(user.password, existing_user.password, client_ip, user.email)
         if psswd_compare:
             session_token = self.generate_session_token(existing_user.email, existing_user.id)
             return {"success": "OK", "body": { "token": session_token, "user_id": existing_user.id} }
         return {"error": "Invalid password"}
 
-    def hash_password(self, plainpassword: str):
-        encoded = plainpassword.encode('utf-8')
-        salt = bcrypt.gensalt()
-        hashed_password = bcrypt.hashpw(encoded, salt)
-        decoded_hashed = hashed_password.decode('utf-8')
-        return decoded_hashed
+    async def hash_password(self, plainpassword: str, client_ip: Optional[str] = None, email: Optional[str] = None) -> str:
+        """Runs in the password pool, raises PasswordBusyError when it's saturated"""
+        return await password_hasher.hash(plainpassword, client_ip, email)
 
-    def verify_password(self, plaintext_pw: str, hashed_pw: str):
-        plaintext_pw_bytes = plaintext_pw.encode('utf-8')
-        hashed_pw_bytes = hashed_pw.encode('utf-8')
-        return bcrypt.checkpw(plaintext_pw_bytes, hashed_pw_bytes)
+    async def verify_password(self, plaintext_pw: str, hashed_pw: str, client_ip: Optional[str] = None, email: Optional[str] = None) -> bool:
+        """Runs in the password pool, raises PasswordBusyError when it's saturated"""
+        return await password_hasher.verify(plaintext_pw, hashed_pw, client_ip, email)
     
     def generate_session_token(self, email: str, user_id: str):
         to_encode = {"email": email, "id": user_id}.copy()
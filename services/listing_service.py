@@ -1,8 +1,27 @@
+from typing import List, Optional, Tuple
+from classes import SelectListing
+from data import WRITE_PRIORITY_BACKGROUND, run_in_transaction
+from repository.listing_latest_repository import ListingLatestRepository
 from repository.listing_repository import ListingRepository
+from repository.price_history_repository import PriceHistoryRepository
 
 
 class ListingService:
     def __init__(self):
         self.listing_repository = ListingRepository()
+        self.price_history_repository = PriceHistoryRepository()
+        self.listing_latest_repository = ListingLatestRepository()
 
+    async def persist_listings(self, batch: List[Tuple[SelectListing, Optional[str]]], priority: int = WRITE_PRIORITY_BACKGROUND) -> int:
+        """Write a batch of parsed (listing, user_id) results in one transaction: listing upserts, relations
+        for the ones added by a user, price points and the latest-state rows. Returns the inserted price points."""
+        listings = [listing for listing, _ in batch]
+        observations = [(listing.id, price_history, listing.stock) for listing in listings for price_history in listing.price_history]
 
+        async def write(conn):
+            await self.listing_repository.upsert_listings(conn, listings)
+            await self.listing_repository.listing_relation_repo.insert_listing_relations(conn, [(user_id, listing.id) for listing, user_id in batch if user_id])
+            inserted = await self.price_history_repository.add_price_histories(conn, observations)
+            await self.listing_latest_repository.update_latest_many(conn, [(listing_id, price_history) for listing_id, price_history, _ in observations])
+            return inserted
+        return await run_in_transaction(write, priority)
@@ -1,6 +1,8 @@
+from repository.listing_latest_repository import ListingLatestRepository
 from repository.price_history_repository import PriceHistoryRepository
 class PriceHistoryService:
     def __init__(self):
         self.price_history_repository = PriceHistoryRepository()
+        self.listing_latest_repository = ListingLatestRepository()
 
 
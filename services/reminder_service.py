@@ -1,74 +1,73 @@
+import logging
+from notification_worker import notification_worker
+from repository.outbox_repository import OutboxRepository
 from repository.reminder_repository import ReminderRepository
-from classes import SelectListing, SelectReminder
-from telegram_bot import telegram_app, RECIPENT_ID
+from repository.settings_repository import SettingsRepository
+from classes import InsertNotification, SelectListing, SelectReminder
+from notification_routes import notification_routes
+from reminder_rules import ListingChange, detect_change, reminder_index
 
 class ReminderService:
     def __init__(self):
         self.reminder_repository = ReminderRepository()
+        self.outbox_repository = OutboxRepository()
+        self.settings_repository = SettingsRepository()
+        self.logger = logging.getLogger(__name__)
 
-    async def update_reminders(self):
-        await self.reminder_repository.get_and_update_reminders()
+    async def load_reminders(self):
+        await self.reminder_repository.load_index()
+        await self.settings_repository.load_routes()
 
-    async def remind_stock_status(self, new_listing: SelectListing, prev_listing: SelectListing):
-        reminders = await self.reminder_repository.get_reminders_by_target_product_id(new_listing.id, True) #use cached data to avoid db calls
-        if new_listing.stock == 0 and prev_listing.stock > 0:
-            for reminder in reminders:
-                if reminder.type == "out_of_stock" and reminder.target_product_id == new_listing.id:
-                    await self.send_reminder(reminder, new_listing)
-        elif new_listing.stock > 0 and prev_listing.stock == 0:
-            for reminder in reminders:
-                if reminder.type == "back_in_stock" and reminder.target_product_id == new_listing.id:
-                    await self.send_reminder(reminder, new_listing)
-    
-    async def remind_price_status(self, new_listing: SelectListing, prev_listing: SelectListing):
-        reminders = await self.reminder_repository.get_reminders_by_target_product_id(new_listing.id, True)
-        if new_listing.price_history[0].price < prev_listing.price_history[0].price:
-            for reminder in reminders:
-                if reminder.type == "price_drop" and reminder.target_product_id == new_listing.id:
-                    await self.send_reminder(reminder, new_listing)
-        elif new_listing.price_history[0].price > prev_listing.price_history[0].price:
-            for reminder in reminders:
-                if reminder.type == "price_increase" and reminder.target_product_id == new_listing.id:
-                    await self.send_reminder(reminder, new_listing)
+    async def remind_changes(self, existing_listing: SelectListing, parsed_listing: SelectListing):
+        """Queue the reminders whose rules match the listing's change events, only listings that changed get this far.
+        Every subscriber's notification goes into the outbox in one write, delivery happens in the notification worker."""
+        change = detect_change(existing_listing, parsed_listing)
+        if change is None:
+            return
+        notifications = []
+        for reminder in reminder_index.matching(change):
+            recipient = notification_routes.recipient(reminder.user_id, reminder.method)
+            if recipient is None:
+                self.logger.warning(f"Reminder {reminder.id} skipped, user {reminder.user_id} has no {reminder.method} address in settings")
+                continue
+            notifications.append(InsertNotification(
+                idempotency_key=f"{reminder.id}:{change.observed_at}",
+                channel=reminder.method,
+                recipient=recipient,
+                message=self.format_reminder(reminder, parsed_listing, change)
+            ))
+        if notifications:
+            await self.outbox_repository.enqueue(notifications)
+            notification_worker.notify()
 
-    async def send_reminder(self, reminder: SelectReminder, listing: SelectListing):
-        match reminder.method:
-            case "telegram":
-                await self.send_telegram_reminder(reminder, listing)
-            case "sms":
-                await self.send_sms_reminder(reminder, listing)
-            case "email":
-                await self.send_email_reminder(reminder, listing)
-    
-    async def send_telegram_reminder(self, reminder: SelectReminder, listing: SelectListing):
-        print(f"Sending telegram reminder for {listing.id}")
+    def format_reminder(self, reminder: SelectReminder, listing: SelectListing, change: ListingChange) -> str:
         reminder_message = ""
         match reminder.type:
             case "out_of_stock":
                 reminder_message = f"❌ {listing.title} is now out of stock\n\nView listing: {listing.url}"
             case "back_in_stock":
-                reminder_message = f"✅ {listing.title} is back in stock!\n\nQuantity available: {listing.stock}\nPrice: {listing.price_history[0].currency} {listing.price_history[0].price}\n\nView listing: {listing.url}"
+                reminder_message = f"✅ {listing.title} is back in stock!\n\nQuantity available: {listing.stock}"
+                # A page without a parsed price still reports the stock
+                if change.new_price is not None:
+                    reminder_message += f"\nPrice: {change.currency} {change.new_price}"
+                reminder_message += f"\n\nView listing: {listing.url}"
             case "price_drop":
-                old_price = listing.price_history[1].price if len(listing.price_history) > 1 else None
-                new_price = listing.price_history[0].price
-                diff = old_price - new_price if old_price else None
-                reminder_message = f"📉 Price dropped for {listing.title}!\n\nNew price: {listing.price_history[0].currency} {new_price}"
+                # The change carries both prices, price events are only detected when both were parsed
+                diff = change.old_price - change.new_price if change.old_price else None
+                reminder_message = f"📉 Price dropped for {listing.title}!\n\nNew price: {change.currency} {change.new_price}"
                 if diff:
-                    reminder_message += f"\nPrice difference: {listing.price_history[0].currency} {diff:.2f}"
+                    reminder_message += f"\nPrice difference: {change.currency} {diff:.2f}"
                 reminder_message += f"\n\nView listing: {listing.url}"
             case "price_increase":
-                old_price = listing.price_history[1].price if len(listing.price_history) > 1 else None
-                new_price = listing.price_history[0].price
-                diff = new_price - old_price if old_price else None
-                reminder_message = f"📈 Price increased for {listing.title}!\n\nNew price: {listing.price_history[0].currency} {new_price}"
+                diff = change.new_price - change.old_price if change.old_price else None
+                reminder_message = f"📈 Price increased for {listing.title}!\n\nNew price: {change.currency} {change.new_price}"
                 if diff:
-                    reminder_message += f"\nPrice difference: {listing.price_history[0].currency} {diff:.2f}"
+                    reminder_message += f"\nPrice difference: {change.currency} {diff:.2f}"
                 reminder_message += f"\n\nView listing: {listing.url}"
-        await telegram_app.bot.send_message(chat_id=RECIPENT_ID, text=reminder_message)
-
-    async def send_sms_reminder(self, reminder: SelectReminder, listing: SelectListing):
-        print(f"Sending sms reminder for {listing.id}")
-
-    async def send_email_reminder(self, reminder: SelectReminder, listing: SelectListing):
-        print(f"Sending email reminder for {listing.id}")
+            case "price_below":
+                reminder_message = f"🎯 {listing.title} is now below {change.currency} {reminder.threshold}!\n\nNew price: {change.currency} {change.new_price}\nWas: {change.currency} {change.old_price}\n\nView listing: {listing.url}"
+            case "price_drop_percent":
+                percent = (change.old_price - change.new_price) / change.old_price * 100
+                reminder_message = f"📉 {listing.title} dropped {percent:.0f}%!\n\nNew price: {change.currency} {change.new_price}\nWas: {change.currency} {change.old_price}\n\nView listing: {listing.url}"
+        return reminder_message
 
@@ -6,17 +6,17 @@ import os
 import zipfile
 import requests
 from classes import ScrapedListing
-from ebay import Ebay
+from ebay import ebay_client
 from repository.zip_repository import ZipRepository
 
 
 class ScraperService:
     def __init__(self) -> None:
-        self.ebay = Ebay()
+        self.ebay = ebay_client
         self.zip_repository = ZipRepository()
 
     async def scrape_listing_details(self, url: str, download_images: bool):
-        listing_details = self.ebay.get_listing_details(url, download_images)
+        listing_details = await self.ebay.get_listing_details(url, download_images)
         downloaded_images = self.download_images(listing_details.images)
         created_sheet = self.create_sheet(listing_details)
         downloaded_images.append(created_sheet)
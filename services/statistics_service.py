@@ -9,31 +9,6 @@ class StatisticsService:
     def __init__(self) -> None:
         self.listing_repository = ListingRepository()
 
-    async def get_price_data_between_dates(
-        self, listing_ebay_id: str, start_date: CustomDate, end_date: CustomDate
-    ) -> Dict[str, Optional[float]]:
-        listing = await self.listing_repository.get_listing_by_id(listing_ebay_id)
-        if not listing or not listing.price_history:
-            return {}
-        date_map = {}
-        start_datetime = start_date.to_datetime()
-        end_datetime = end_date.to_datetime()
-        current_datetime = start_datetime
-        while current_datetime <= end_datetime:
-            #get daily precision
-            key = current_datetime.strftime("%d %m %Y")
-            if len(listing.price_history) == 0:
-                date_map[key] = 0
-                continue
-            existing_time = listing.price_history.pop()
-            existing_datetime = datetime.strptime(existing_time.date, '%Y-%m-%dT%H:%M:%S.%f')
-            if existing_datetime == current_datetime:
-                date_map[key] = existing_time.price
-            else:
-                date_map[key] = 0
-            current_datetime = current_datetime + timedelta(days=1)
-        return date_map
-        
     async def get_price_data_between_dates2(
         self, listing_ebay_id: str, start_date: CustomDate, end_date: CustomDate
     ) -> Dict[str, Optional[float]]:
@@ -50,14 +25,14 @@ class StatisticsService:
         }
 
         for price_entry in listing.price_history:
-            price_date = price_entry.date  
-            price_value = price_entry.price  
-
-            if isinstance(price_date, str):
-                price_date = datetime.strptime(price_date, '%Y-%m-%dT%H:%M:%S.%f')
+            # Each entry holds its price from date until last_seen, fill every day of that run
+            run_start = datetime.fromisoformat(price_entry.date)
+            run_end = datetime.fromisoformat(price_entry.last_seen) if price_entry.last_seen else run_start
+            day = max(run_start.replace(hour=0, minute=0, second=0, microsecond=0), start_dt)
+            while day <= min(run_end, end_dt):
+                date_key = day.strftime('%Y-%m-%d')
+                if date_map[date_key] is None:
+                    date_map[date_key] = price_entry.price
+                day = day + timedelta(days=1)
 
-            if start_dt <= price_date <= end_dt:
-                date_key = price_date.strftime('%Y-%m-%d')
-                date_map[date_key] = price_value
-
-        return date_map
\ No newline at end of file
+        return date_map
@@ -3,7 +3,7 @@ from fastapi import WebSocket
 from jose import ExpiredSignatureError, JWTError, jwt
 from datetime import datetime, timedelta
 import os
-from classes import SelectUser
+from classes import Principal
 from repository.user_repository import UserRepository
 
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("WS_ACCESS_TOKEN_EXPIRE_MINUTES")) or 18000
@@ -17,7 +17,7 @@ if not SECRET_KEY:
 class WSService:
     def __init__(self) -> None:
         self.user_repository = UserRepository()
-        self.users: Dict[str, tuple[SelectUser, WebSocket]] = {}
+        self.users: Dict[str, tuple[Principal, WebSocket]] = {}
 
     def add_websocket(self, websocket: WebSocket):
         self.websocket = websocket
@@ -26,7 +26,12 @@ class WSService:
         target_user = self.users.get(user_id)
         if target_user:
             user, websocket = target_user
-            await websocket.send_json(message_obj)
+            try:
+                await websocket.send_json(message_obj)
+            except Exception as e:
+                # Closed without a disconnect reaching us, forget it so it stops counting as online
+                print(f"Websocket send to {user.email} failed: {str(e)}")
+                self.disconnect(websocket)
     
     def get_online_users(self):
         return [x[0] for x in self.users.items()]
@@ -40,27 +45,25 @@ class WSService:
     async def connect(self, token: str, websocket: WebSocket):
         validated_user = await self.validate_user(token)
         if validated_user.get("success"):
-            user: SelectUser = validated_user['body']['user']
+            user: Principal = validated_user['body']['user']
             session_token = self.generate_session_token(user.email, user.id)
             self.users[user.id] = (user, websocket)
             print("Websocket connected with ", user.email)
-            return {"success": "OK", "body": session_token}
+            return {"success": "OK", "body": session_token, "user_id": user.id}
         return {"error": "User not authenticated"}
     
-    async def disconnect(self, token: str):
-        validated_user = await self.validate_user(token)
-        if validated_user.get('success'):
-            del self.users.validated_user['body']['user'].id
+    def disconnect(self, websocket: WebSocket):
+        for user_id in [user_id for user_id, (_, user_websocket) in self.users.items() if user_websocket is websocket]:
+            del self.users[user_id]
 
 
-    async def validate_user(self, token: str) -> Dict[str, Union[bool, Optional[str], Optional[SelectUser]]]:
+    async def validate_user(self, token: str) -> Dict[str, Union[bool, Optional[str], Optional[Principal]]]:
         try:
             decoded_jwt = jwt.decode(token, SECRET_KEY, ALGORITHM)
             user_id = decoded_jwt['id']
             if user_id:
-                user = await self.user_repository.get_user_by_id(decoded_jwt['id'])
+                user = await self.user_repository.get_principal_by_id(decoded_jwt['id'])
                 if user:
-                    user.password = ''
                     return {"success": "OK", "body": {"user": user}}
             return {"error": "No user found"}
         except ExpiredSignatureError:
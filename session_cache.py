@@ -0,0 +1,69 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+from classes import Principal
+
+# How long a validated session is trusted without looking the user up again
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS") or 60)
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE") or 10000)
+
+def token_key(token: str) -> str:
+    """Tokens are kept by digest, the cache never holds a usable credential"""
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).hexdigest()
+
+class SessionCache:
+    """LRU of validated session tokens -> principal. An entry expires after the TTL or with its token,
+    whichever is first, and is dropped on logout or when the user changes."""
+    def __init__(self, ttl: float = SESSION_CACHE_TTL_SECONDS, size: int = SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.entries: OrderedDict[str, Tuple[Principal, float]] = OrderedDict()
+        self.keys_by_user: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Principal]:
+        key = token_key(token)
+        entry = self.entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                self.remove(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, token: str, principal: Principal, token_expires_at: Optional[float] = None):
+        if self.size <= 0:
+            return
+        key = token_key(token)
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        self.entries[key] = (principal, expires_at)
+        self.entries.move_to_end(key)
+        self.keys_by_user.setdefault(principal.id, set()).add(key)
+        while len(self.entries) > self.size:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        user_keys = self.keys_by_user.get(entry[0].id)
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self.keys_by_user[entry[0].id]
+
+    def invalidate_token(self, token: str):
+        self.remove(token_key(token))
+
+    def invalidate_user(self, user_id: str):
+        for key in list(self.keys_by_user.get(user_id, ())):
+            self.remove(key)
+
+session_cache = SessionCache()